@@ -1,7 +1,15 @@
 from pyramid.config import Configurator
+from pyramid.tweens import INGRESS
+from pyramid.events import BeforeRender
+from pyramid.settings import asbool
+from sqlalchemy.orm import joinedload, selectinload
+from clld.interfaces import ICtxFactoryQuery
+from clld.web.app import CtxFactoryQuery
+from clld.db.models import common
 
 # we must make sure custom models are known at database initialization!
 from cdk import models
+from cdk import util
 
 
 _ = lambda s: s
@@ -12,9 +20,54 @@ _('Sentence')
 _('Sentences')
 
 
+class CdkCtxFactoryQuery(CtxFactoryQuery):
+    @staticmethod
+    def cached(req):
+        """
+        Whether the fragments of the detail page of an entry are cached - in which case
+        the related data doesn't need to be loaded.
+        """
+        return all(
+            util.FRAGMENTS.get(util.FRAGMENTS.key(req, 'unit', req.matchdict['id'], name))
+            for name in ['content', 'sidebar'])
+
+    def refined_query(self, query, model, req):
+        if model == common.Unit and not self.cached(req):
+            # Load all the data displayed on the detail page of an entry - i.e. the meanings
+            # with their examples and the variants - with a fixed number of queries.
+            examples = selectinload(common.Unit.unitvalues)\
+                .selectinload(common.UnitValue.examples)
+            sentence = examples.joinedload(models.CounterpartExample.sentence)
+            query = query.options(
+                joinedload(common.Unit.language),
+                selectinload(common.Unit.unitvalues)
+                .joinedload(common.UnitValue.unitparameter),
+                sentence.joinedload(common.Sentence.language),
+                sentence.selectinload(common.Sentence.references)
+                .joinedload(common.SentenceReference.source),
+                joinedload(models.Entry.variantgroup)
+                .selectinload(models.VariantGroup.entries)
+                .joinedload(models.Entry.language))
+        return query
+
+
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
     config = Configurator(settings=settings)
     config.include('clldmpg')
+    config.registry.registerUtility(CdkCtxFactoryQuery(), ICtxFactoryQuery)
+    util.FRAGMENTS.configure(settings)
+    config.add_request_method(util.data_stamp, 'data_stamp', reify=True)
+    config.add_request_method(util.data_version, 'data_version', reify=True)
+    # Validate requests by the data version - within the transaction of the request:
+    config.add_tween(
+        'cdk.tweens.ConditionalRequests', under=('pyramid_tm.tm_tween_factory', INGRESS))
+    config.add_route('fulltext', '/search')
+    config.add_route('snapshot', '/snapshots/{type}/{id}.json')
+    if asbool(settings.get('cdk.profiling')):
+        config.add_tween('cdk.tweens.Profiling', under=INGRESS)
+        config.add_subscriber('cdk.tweens.profile_rendering', BeforeRender)
+        config.add_route('profiling', '/_profiling')
+        config.add_view('cdk.views.profiling', route_name='profiling', renderer='json')
     return config.make_wsgi_app()
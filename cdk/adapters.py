@@ -1,2 +1,97 @@
+import io
+import csv
+import json
+import zipfile
+
+from pyramid.response import Response
+from clld import interfaces
+from clld.util import safe_overwrite
+from clld.db.models import common
+from clld.web.adapters.base import Index
+from clld.web.adapters.download import Download, format_readme
+
+from cdk import cldf
+
+
+class CldfDictionary(Download):
+    """
+    The dictionary as CLDF Dictionary, a zip archive of CSV tables with metadata.
+    """
+    ext = 'cldf'
+
+    def create(self, req, filename=None, verbose=True, outfile=None):
+        with safe_overwrite(outfile or self.abspath(req)) as tmp:
+            with zipfile.ZipFile(tmp.as_posix(), 'w', zipfile.ZIP_DEFLATED) as zipf:
+                cldf.write(cldf.zip_opener(zipf))
+                zipf.writestr(
+                    'README.txt',
+                    format_readme(req, req.db.query(common.Dataset).first()).encode('utf8'))
+
+
+class StreamingIndex(Index):
+    """
+    Download of the complete - filtered and sorted - result of a datatable, e.g.
+    `/unitvalues.csv?sSearch_8=Russian`, written as CSV unless `write_header` and
+    `write_row` are overridden.
+
+    The rows are streamed from the database to the client - so neither the result is
+    buffered in memory, nor paged with many queries. Streaming starts after the request has
+    passed the tweens, so with `cdk.profiling` the queries of a download are not counted,
+    while `cdk.tweens.ConditionalRequests` validates downloads by the data version like all
+    pages: the rows are only read again after `set_data_version`.
+    """
+    chunksize = 1000
+
+    def write_header(self, fp, names):
+        csv.writer(fp).writerow(names)
+
+    def write_row(self, fp, names, row):
+        csv.writer(fp).writerow(row)
+
+    def iter_chunks(self, names, rows):
+        fp = io.StringIO()
+        self.write_header(fp, names)
+        for i, row in enumerate(rows, start=1):
+            self.write_row(fp, names, row)
+            if i % self.chunksize == 0:
+                yield fp.getvalue().encode('utf8')
+                fp.seek(0)
+                fp.truncate()
+        yield fp.getvalue().encode('utf8')
+
+    def render_to_response(self, ctx, req):
+        names = [name for name, _ in ctx.download_cols()]
+        res = Response(
+            app_iter=self.iter_chunks(names, ctx.iter_download(chunksize=self.chunksize)),
+            content_type=self.mimetype,
+            charset='utf-8')
+        res.content_disposition = 'attachment; filename="{0}.{1}"'.format(
+            ctx.eid.lower(), self.extension)
+        return res
+
+
+class CsvIndex(StreamingIndex):
+    name = 'CSV'
+    mimetype = 'text/csv'
+    extension = 'csv'
+
+
+class NdjsonIndex(StreamingIndex):
+    name = 'NDJSON'
+    mimetype = 'application/x-ndjson'
+    extension = 'ndjson'
+
+    def write_header(self, fp, names):
+        pass
+
+    def write_row(self, fp, names, row):
+        fp.write(json.dumps(dict(zip(names, row)), ensure_ascii=False))
+        fp.write('\n')
+
+
 def includeme(config):
-    pass
+    config.register_download(
+        CldfDictionary(common.Dataset, 'cdk', description='CLDF Dictionary'))
+    for interface in [interfaces.IUnitValue, interfaces.ISentence]:
+        for cls in [CsvIndex, NdjsonIndex]:
+            config.register_adapter(cls, interface)
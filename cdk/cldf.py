@@ -0,0 +1,239 @@
+"""
+Export of the dictionary as CLDF Dictionary - see https://cldf.clld.org
+
+The tables are written row by row while iterating over the results of queries with
+server-side cursors - so memory use does not depend on the size of the dictionary.
+Rows spread over several rows of a query result - e.g. the examples of a sense - are
+collected from consecutive rows of a query ordered accordingly.
+"""
+import io
+import csv
+import json
+import time
+import zipfile
+from itertools import groupby
+from collections import OrderedDict
+
+from sqlalchemy import func
+from clld.db.meta import DBSession
+from clld.db.models import common
+from clld.lib.bibtex import EntryType
+
+from cdk import models
+
+CONFORMS_TO = 'http://cldf.clld.org/v1.0/terms.rdf#{0}'
+
+
+def column(name, term=None, datatype='string', separator=None):
+    res = OrderedDict(name=name, datatype=datatype)
+    if term:
+        res['propertyUrl'] = CONFORMS_TO.format(term)
+    if separator:
+        res['separator'] = separator
+    return res
+
+
+def languages(chunksize):
+    for lang in DBSession.query(common.Language)\
+            .order_by(common.Language.pk)\
+            .yield_per(chunksize):
+        yield [
+            lang.id, lang.name, lang.glottocode, lang.iso_code, lang.latitude, lang.longitude]
+
+
+def entries(chunksize):
+    for row in DBSession.query(
+            models.Entry.id,
+            common.Language.id,
+            models.Entry.name,
+            models.Entry.pos,
+            models.Entry.variant,
+            models.Entry.variantgroup_pk,
+            models.Entry.donor,
+            models.Entry.disambiguation,
+            models.Entry.aspect,
+            models.Entry.plural)\
+            .join(common.Language, common.Language.pk == models.Entry.language_pk)\
+            .order_by(models.Entry.pk)\
+            .yield_per(chunksize):
+        yield list(row)
+
+
+def senses(chunksize):
+    rows = DBSession.query(
+        common.UnitValue.id,
+        common.Unit.id,
+        models.Meaning.english,
+        models.Meaning.russian,
+        models.Meaning.german,
+        common.Sentence.id)\
+        .join(common.Unit, common.Unit.pk == common.UnitValue.unit_pk)\
+        .join(models.Meaning, models.Meaning.pk == common.UnitValue.unitparameter_pk)\
+        .outerjoin(
+            models.CounterpartExample,
+            models.CounterpartExample.unitvalue_pk == common.UnitValue.pk)\
+        .outerjoin(common.Sentence, common.Sentence.pk == models.CounterpartExample.sentence_pk)\
+        .order_by(
+            common.UnitValue.pk,
+            models.CounterpartExample.location,
+            models.CounterpartExample.sentence_pk)\
+        .yield_per(chunksize)
+    for _, group in groupby(rows, lambda r: r[0]):
+        group = list(group)
+        yield list(group[0][:-1]) + [[r[-1] for r in group if r[-1]]]
+
+
+def examples(chunksize):
+    # The first of the locations of the example - deterministic, unlike a limited subquery:
+    location = DBSession.query(func.min(models.CounterpartExample.location))\
+        .filter(models.CounterpartExample.sentence_pk == common.Sentence.pk)\
+        .scalar_subquery()
+    rows = DBSession.query(
+        common.Sentence.id,
+        common.Language.id,
+        common.Sentence.name,
+        common.Sentence.description,
+        location,
+        common.Source.id,
+        common.SentenceReference.description)\
+        .join(common.Language, common.Language.pk == common.Sentence.language_pk)\
+        .outerjoin(
+            common.SentenceReference,
+            common.SentenceReference.sentence_pk == common.Sentence.pk)\
+        .outerjoin(common.Source, common.Source.pk == common.SentenceReference.source_pk)\
+        .order_by(common.Sentence.pk, common.SentenceReference.pk)\
+        .yield_per(chunksize)
+    for _, group in groupby(rows, lambda r: r[0]):
+        group = list(group)
+        yield list(group[0][:-2]) + [[
+            '{0}[{1}]'.format(src, pages) if pages else src
+            for _, _, _, _, _, src, pages in group if src]]
+
+
+# Tables of the dataset: (component, file name, columns, function yielding the rows)
+TABLES = [
+    ('LanguageTable', 'languages.csv', [
+        column('ID', 'id'),
+        column('Name', 'name'),
+        column('Glottocode', 'glottocode'),
+        column('ISO639P3code', 'iso639P3code'),
+        column('Latitude', 'latitude', datatype='decimal'),
+        column('Longitude', 'longitude', datatype='decimal'),
+    ], languages),
+    ('EntryTable', 'entries.csv', [
+        column('ID', 'id'),
+        column('Language_ID', 'languageReference'),
+        column('Headword', 'headword'),
+        column('Part_Of_Speech', 'partOfSpeech'),
+        column('Variant', datatype='boolean'),
+        column('Variant_Group', datatype='integer'),
+        column('Donor'),
+        column('Disambiguation'),
+        column('Aspect'),
+        column('Plural'),
+    ], entries),
+    ('SenseTable', 'senses.csv', [
+        column('ID', 'id'),
+        column('Entry_ID', 'entryReference'),
+        column('Description', 'description'),
+        column('Russian'),
+        column('German'),
+        column('Example_IDs', 'exampleReference', separator=' '),
+    ], senses),
+    ('ExampleTable', 'examples.csv', [
+        column('ID', 'id'),
+        column('Language_ID', 'languageReference'),
+        column('Primary_Text', 'primaryText'),
+        column('Translated_Text', 'translatedText'),
+        column('Location'),
+        column('Source', 'source', separator=';'),
+    ], examples),
+]
+FOREIGN_KEYS = {
+    # (table, column): referenced table
+    ('entries.csv', 'Language_ID'): 'languages.csv',
+    ('senses.csv', 'Entry_ID'): 'entries.csv',
+    ('senses.csv', 'Example_IDs'): 'examples.csv',
+    ('examples.csv', 'Language_ID'): 'languages.csv',
+}
+
+
+def metadata():
+    """
+    :return: The CLDF metadata of the dataset, as JSON serializable `dict`.
+    """
+    dataset = DBSession.query(common.Dataset).first()
+    tables = []
+    for component, fname, columns, _ in TABLES:
+        tables.append(OrderedDict([
+            ('url', fname),
+            ('dc:conformsTo', CONFORMS_TO.format(component)),
+            ('tableSchema', OrderedDict([
+                ('columns', columns),
+                ('primaryKey', ['ID']),
+                ('foreignKeys', [
+                    dict(
+                        columnReference=[col],
+                        reference=dict(resource=ref, columnReference=['ID']))
+                    for (table, col), ref in sorted(FOREIGN_KEYS.items()) if table == fname]),
+            ])),
+        ]))
+    return OrderedDict([
+        ('@context', ['http://www.w3.org/ns/csvw', {'@language': 'en'}]),
+        ('dc:conformsTo', CONFORMS_TO.format('Dictionary')),
+        ('dc:title', dataset.name if dataset else None),
+        ('dc:license', dataset.license if dataset else None),
+        ('dc:source', 'sources.bib'),
+        ('dialect', {'commentPrefix': None}),
+        ('tables', tables),
+    ])
+
+
+def format_value(value, separator=None):
+    if separator:
+        return separator.join(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else value
+
+
+def zip_opener(zipf):
+    """
+    :return: Function to open members of the `zipfile.ZipFile` `zipf` for writing.
+    """
+    def open_(name):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return zipf.open(info, 'w', force_zip64=True)
+    return open_
+
+
+def write(open_, chunksize=1000):
+    """
+    Write the CLDF dataset.
+
+    :param open_: Function returning a binary file object opened for writing when called \
+    with a file name.
+    :return: `OrderedDict` mapping file names of the tables to the number of rows written.
+    """
+    res = OrderedDict()
+    with open_('Dictionary-metadata.json') as fp:
+        fp.write(json.dumps(metadata(), indent=4, ensure_ascii=False).encode('utf8'))
+
+    with io.TextIOWrapper(open_('sources.bib'), encoding='utf8') as fp:
+        for src in DBSession.query(common.Source).order_by(common.Source.pk).yield_per(chunksize):
+            rec = src.bibtex()
+            # Sources of the dictionary are not typed:
+            rec.genre = rec.genre or EntryType.misc
+            fp.write('{0}\n\n'.format(rec))
+
+    for _, fname, columns, rows in TABLES:
+        with io.TextIOWrapper(open_(fname), encoding='utf8', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow([col['name'] for col in columns])
+            res[fname] = 0
+            for row in rows(chunksize):
+                writer.writerow([
+                    format_value(v, col.get('separator')) for v, col in zip(row, columns)])
+                res[fname] += 1
+    return res
@@ -1,25 +1,242 @@
-from sqlalchemy.orm import joinedload
+from collections import OrderedDict
 
-from clld.web.datatables.base import Col, LinkCol, DetailsRowLinkCol
+from sqlalchemy import and_, or_, false, exists, select, func
+from sqlalchemy.orm import Query, joinedload, selectinload
+from pyramid.settings import asbool
+
+from clld.db.meta import DBSession
+from clld.web.datatables.base import (
+    Col, LinkCol, DetailsRowLinkCol, type_coerce, DISPLAY_LIMIT, DISPLAY_LENGTH,
+)
 from clld.web.datatables.unit import Units
 from clld.web.datatables.unitvalue import Unitvalues
 from clld.web.datatables.sentence import Sentences
-from clld.db.meta import DBSession
 from clld.db.models import common
-from clld.db.util import get_distinct_values
 from clld.web.util.helpers import link
 from clld.web.util.htmllib import HTML
 
-from cdk.models import Entry, Meaning, CounterpartExample
+from cdk.models import Entry, CounterpartExample, CounterpartSearch
 from cdk import util
+from cdk import fts
+
+
+def keyset_pagination(req):
+    """
+    Keyset pagination of datatables is switched on with setting `cdk.keyset_pagination`.
+    """
+    return asbool((req.registry.settings or {}).get('cdk.keyset_pagination'))
+
+
+def seek(orders, cursor):
+    """
+    :param orders: `list` of `(expression, descending)` pairs, defining a total order.
+    :param cursor: `tuple` of values of the expressions for one row.
+    :return: Clause selecting the rows which come after the cursor row in this order.
+    """
+    # NULLs sort as the largest values on PostgreSQL, as the smallest on SQLite.
+    nulls_high = DBSession.bind.dialect.name == 'postgresql'
+
+    def equal(expr, value):
+        return expr.is_(None) if value is None else expr == value
+
+    def after(expr, desc, value):
+        nulls_after = nulls_high != desc
+        if value is None:
+            return false() if nulls_after else expr.isnot(None)
+        res = expr < value if desc else expr > value
+        return or_(res, expr.is_(None)) if nulls_after else res
+
+    clauses = []
+    for i, ((expr, desc), value) in enumerate(zip(orders, cursor)):
+        clauses.append(and_(
+            *[equal(e, v) for (e, _), v in zip(orders[:i], cursor)] + [after(expr, desc, value)]))
+    return or_(*clauses)
+
+
+class PageQuery(Query):
+    """
+    Query for one page of a datatable, which - when iterated - selects the sort keys of the
+    items as well, and remembers the sort key of the last item as cursor for the next page.
+    """
+    @classmethod
+    def from_query(cls, query, orders, cursor_key):
+        res = cls.__new__(cls)
+        res.__dict__.update(query.__dict__)
+        res._keyset = (orders, cursor_key)
+        return res
+
+    def __iter__(self):
+        orders, cursor_key = self._keyset
+        row = None
+        for row in super(PageQuery, self.add_columns(*[expr for expr, _ in orders])).__iter__():
+            yield row[0]
+        if row is not None:
+            util.CURSORS.set(cursor_key, tuple(row[1:]))
+
+
+class KeysetPagination(object):
+    """
+    Mixin for datatables, adding optional keyset pagination.
+
+    The DataTables front end pages by offset. Paging with OFFSET gets slower the deeper
+    the page, though, because all skipped rows must be read. So for each page served the
+    sort key of its last row - the cursor - is remembered; if the next page is requested,
+    its rows are selected as the rows with larger sort keys - which an index can serve no
+    matter how deep the page is. Pages without known cursor - e.g. pages jumped to, or
+    requested from another process - are selected by offset.
+    """
+    def sort_orders(self):
+        """
+        :return: `list` of `(expression, descending)` pairs, the ordering of `get_query`.
+        """
+        res = []
+        for index in range(min(type_coerce(int, self.req.params.get('iSortingCols', 0), 0), 10)):
+            try:
+                col = self.cols[int(self.req.params.get('iSortCol_%s' % index))]
+            except (TypeError, ValueError, IndexError):  # pragma: no cover
+                continue
+            if col.js_args.get('bSortable', True):
+                orders = col.order()
+                if orders is not None:
+                    if not isinstance(orders, (tuple, list)):
+                        orders = [orders]
+                    desc = self.req.params.get('sSortDir_%s' % index) == 'desc'
+                    res.extend((order, desc) for order in orders)
+        clauses = self.default_order()
+        if not isinstance(clauses, (list, tuple)):
+            clauses = (clauses,)
+        return res + [(clause, False) for clause in clauses]
+
+    def cursor_key(self, start):
+        """
+        The cursor for the row at position `start` depends on the data, the filters and
+        ordering of the datatable, but not on the page size.
+        """
+        params = sorted(
+            (k, v) for k, v in self.req.params.items()
+            if k not in ['iDisplayStart', 'iDisplayLength', 'sEcho', '_'])
+        constraints = [
+            getattr(getattr(self, self.attr_from_constraint(m)), 'pk', None)
+            for m in self.__constraints__]
+        return (
+            self.req.data_version, self.__class__.__name__, tuple(params), tuple(constraints),
+            start)
+
+    def get_query(self, limit=DISPLAY_LIMIT, offset=0, undefer_cols=()):
+        query = super(KeysetPagination, self).get_query(
+            limit=limit, offset=offset, undefer_cols=undefer_cols)
+        if limit is None or not keyset_pagination(self.req):
+            return query
+
+        if 'iDisplayLength' in self.req.params:
+            limit = min(
+                type_coerce(int, self.req.params['iDisplayLength'], DISPLAY_LENGTH),
+                DISPLAY_LIMIT)
+        limit = DISPLAY_LIMIT if limit == -1 else limit
+        start = type_coerce(int, self.req.params.get('iDisplayStart', offset), offset)
+        orders = self.sort_orders()
+
+        cursor = util.CURSORS.get(self.cursor_key(start)) if start else None
+        if cursor is not None:
+            query = query.limit(None).offset(None).filter(seek(orders, cursor)).limit(limit)
+
+        return PageQuery.from_query(query, orders, self.cursor_key(start + limit))
+
+
+class FullTextSearch(object):
+    """
+    Mixin for datatables, restricting the items to the matches of the full-text search
+    passed as request parameter `q` - see `cdk.fts`.
+
+    Subclasses list pairs `(column, type)` in `__fulltext__`: An item matches if `column`
+    holds the pk of a matching object of type `type`.
+    """
+    __fulltext__ = []
+
+    def search_fulltext(self, query):
+        qs = self.req.params.get('q')
+        # Searching is only possible once the index has been built by `prime_cache`:
+        if not qs or not fts.has_index():
+            return query
+        return query.filter(or_(*[
+            col.in_(fts.matches(qs, type_)) for col, type_ in self.__fulltext__]))
+
+    def xhr_query(self):
+        res = super(FullTextSearch, self).xhr_query()
+        if self.req.params.get('q'):
+            # Pass the search on to the XHR requests of the DataTables front end:
+            res['q'] = self.req.params['q']
+        return res
+
+
+class StreamingDownload(object):
+    """
+    Mixin for datatables, providing the complete - filtered and sorted - result for
+    download, see `cdk.adapters.StreamingIndex`.
+    """
+    __toolbar_kw__ = {'dl_formats': OrderedDict([('csv', 'CSV'), ('ndjson', 'NDJSON')])}
+
+    def download_cols(self):
+        """
+        :return: `list` of `(name, expression)` pairs, the fields of the download - by \
+        default the columns of the datatable which map to a column of the model.
+        """
+        return [(col.name, col.model_col) for col in self.cols if col.model_col is not None]
+
+    def download_query(self):
+        """
+        :return: Query selecting the fields of all items matching the filters of the \
+        datatable, in the order of the datatable.
+        """
+        return self.get_query(limit=None).limit(None).offset(None)\
+            .enable_eagerloads(False)\
+            .with_entities(*[expr.label(name) for name, expr in self.download_cols()])
+
+    def iter_download(self, chunksize=1000):
+        """
+        :return: Generator of the rows of the download, read from a server-side cursor.
+        """
+        # The statement is compiled right away, the rows are read on iteration - on a
+        # connection of its own, because the response is streamed after the session of the
+        # request has been closed.
+        stmt = self.download_query().statement
+
+        def rows():
+            with DBSession.bind.connect() as conn:
+                for row in conn.execution_options(
+                        stream_results=True, yield_per=chunksize).execute(stmt):
+                    yield tuple(row)
+        return rows()
+
+
+def language_name(language_pk):
+    return select([common.Language.name])\
+        .where(common.Language.pk == language_pk)\
+        .scalar_subquery()
+
+
+def first_source():
+    return select([func.min(common.Source.name)])\
+        .where(common.SentenceReference.sentence_pk == common.Sentence.pk)\
+        .where(common.SentenceReference.source_pk == common.Source.pk)\
+        .scalar_subquery()
+
+
+def first_location():
+    return select([func.min(CounterpartExample.location)])\
+        .where(CounterpartExample.sentence_pk == common.Sentence.pk)\
+        .scalar_subquery()
 
 
 class RefsCol(Col):
     def search(self, qs):
-        return common.Source.name == qs
+        return exists().where(and_(
+            common.SentenceReference.sentence_pk == common.Sentence.pk,
+            common.SentenceReference.source_pk == common.Source.pk,
+            common.Source.name == qs))
 
     def order(self):
-        return common.Source.name
+        return first_source()
 
     def format(self, item):
         return HTML.ul(*[HTML.li(link(self.dt.req, ref.source), ': ', ref.description) for ref in item.references], class_='unstyled')
@@ -27,35 +244,78 @@ class RefsCol(Col):
 
 class LocationCol(Col):
     def search(self, qs):
-        return CounterpartExample.location == qs
+        return exists().where(and_(
+            CounterpartExample.sentence_pk == common.Sentence.pk,
+            CounterpartExample.location == qs))
 
     def order(self):
-        return CounterpartExample.location
+        return first_location()
 
     def format(self, item):
         return HTML.ul(*[HTML.li(ex.location) for ex in item.examples], class_='unstyled')
 
 
-class Examples(Sentences):
+class Examples(FullTextSearch, KeysetPagination, StreamingDownload, Sentences):
+    __fulltext__ = [(common.Sentence.pk, 'sentence')]
+
     def base_query(self, query):
-        query = query.outerjoin(common.Sentence.examples)
-        query = query.outerjoin(common.Sentence.references, common.Source)
-        query = query.options(
-            joinedload(common.Sentence.examples),
-            joinedload(common.Sentence.references).joinedload(common.SentenceReference.source))
-        return query.distinct()
+        # Filtering and sorting by location or source is done with correlated subqueries,
+        # so there's no need to join the one-to-many relations - and to de-duplicate the
+        # result with DISTINCT.
+        return self.search_fulltext(query).join(common.Language).options(
+            joinedload(common.Sentence.language),
+            selectinload(common.Sentence.examples),
+            selectinload(common.Sentence.references)
+            .joinedload(common.SentenceReference.source))
 
     def col_defs(self):
         res = Sentences.col_defs(self)
         return [
             res[1],
             res[4],
-            LocationCol(self, 'settlement', choices=get_distinct_values(CounterpartExample.location)),
-            RefsCol(self, 'source', choices=get_distinct_values(common.Source.name)),
+            LocationCol(self, 'settlement', choices=util.distinct_values(self.req, CounterpartExample.location)),
+            RefsCol(self, 'source', choices=util.distinct_values(self.req, common.Source.name)),
             res[6]]
 
+    def download_cols(self):
+        return [
+            ('id', common.Sentence.id),
+            ('text', common.Sentence.name),
+            ('translation', common.Sentence.description),
+            ('language', common.Language.name),
+            # Examples are recorded in one location and cited from one source:
+            ('settlement', first_location()),
+            ('source', first_source()),
+        ]
+
+
+def prefix_end(prefix):
+    """
+    :return: The smallest string larger than all strings starting with `prefix` - in code \
+    point order, as compared by SQLite.
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+
 
 class WordCol(LinkCol):
+    def __init__(self, dt, name, normalized=Entry.normalized, **kw):
+        LinkCol.__init__(self, dt, name, **kw)
+        # The column holding the normalized forms of the items:
+        self.normalized = normalized
+
+    def search(self, qs):
+        # Prefix search on the normalized forms, in a way the index can be used:
+        prefix = util.normalize(qs)
+        if not prefix:
+            return None
+        if DBSession.bind.dialect.name == 'postgresql':  # pragma: no cover
+            return self.normalized.startswith(prefix, autoescape=True)
+        end = prefix_end(prefix)
+        if end is None:
+            return self.normalized >= prefix
+        return and_(self.normalized >= prefix, self.normalized < end)
+
     def get_attrs(self, item):
         item = self.get_obj(item)
         form = util.form(item.name)
@@ -65,11 +325,19 @@ class WordCol(LinkCol):
 
 
 class DialectCol(Col):
+    def __init__(self, dt, name, language_pk=common.Unit.language_pk, **kw):
+        kw['choices'] = [(id_, name_) for _, id_, name_ in util.languages(dt.req)]
+        Col.__init__(self, dt, name, **kw)
+        # The column holding the language pk of the items:
+        self.language_pk = language_pk
+
     def search(self, qs):
-        return common.Language.id == qs
+        # Filter by foreign key, so no join with the language table is needed:
+        pks = {id_: pk for pk, id_, _ in util.languages(self.dt.req)}
+        return self.language_pk == pks.get(qs)
 
     def order(self):
-        return common.Language.pk
+        return self.language_pk
 
     def format(self, item):
         item = self.get_obj(item)
@@ -80,57 +348,65 @@ class VariantCol(Col):
     def __init__(self, dt, name, **kw):
         kw['sDescription'] = 'If "yes" the word is a dialectal variant.'
         kw['sFilter'] = '2'
-        kw['model_col'] = Entry.variant
+        kw.setdefault('model_col', Entry.variant)
         kw['choices'] = [('1', 'yes'), ('2', 'no')]
         Col.__init__(self, dt, name, **kw)
 
     def search(self, qs):
         if qs == '1':
-            return Entry.variant == True
+            return self.model_col == True
         if qs == '2':
-            return Entry.variant == False
+            return self.model_col == False
 
     def format(self, item):
         item = self.get_obj(item)
         return 'yes' if item.variant else 'no'
 
 
-class Entries(Units):
+class Entries(FullTextSearch, KeysetPagination, Units):
+    __fulltext__ = [(Entry.pk, 'unit')]
+
+    def base_query(self, query):
+        return Units.base_query(self, self.search_fulltext(query))
+
     def col_defs(self):
         return [
             WordCol(self, 'name'),
             VariantCol(self, 'variant'),
-            Col(self, 'pos', model_col=Entry.pos, choices=get_distinct_values(Entry.pos)),
-            Col(self, 'aspect', model_col=Entry.aspect, choices=get_distinct_values(Entry.aspect)),
-            Col(self, 'plural', model_col=Entry.plural, choices=get_distinct_values(Entry.plural)),
-            Col(self, 'donor', sTitle='loan from', model_col=Entry.donor, choices=get_distinct_values(Entry.donor)),
-            DialectCol(
-                self,
-                'variety',
-                model_col=common.Language.name,
-                choices=[(l.id, l.name) for l in DBSession.query(common.Language)]),
+            Col(self, 'pos', model_col=Entry.pos, choices=util.distinct_values(self.req, Entry.pos)),
+            Col(self, 'aspect', model_col=Entry.aspect, choices=util.distinct_values(self.req, Entry.aspect)),
+            Col(self, 'plural', model_col=Entry.plural, choices=util.distinct_values(self.req, Entry.plural)),
+            Col(self, 'donor', sTitle='loan from', model_col=Entry.donor, choices=util.distinct_values(self.req, Entry.donor)),
+            DialectCol(self, 'variety', model_col=common.Language.name),
         ]
 
 
-class Counterparts(Unitvalues):
+class Counterparts(FullTextSearch, KeysetPagination, StreamingDownload, Unitvalues):
+    # Counterparts match by form or meaning:
+    __fulltext__ = [
+        (CounterpartSearch.unit_pk, 'unit'),
+        (CounterpartSearch.unitparameter_pk, 'unitparameter'),
+    ]
+
+    def db_model(self):
+        # Counterparts are filtered, sorted and counted using the denormalized search
+        # table, the rows of which are the items of the datatable.
+        return CounterpartSearch
+
     def base_query(self, query):
-        query = query \
-            .join(common.Unit) \
-            .join(common.Unit.language) \
-            .join(common.UnitParameter) \
-            .options(
-                joinedload(common.UnitValue.unit).joinedload(common.Unit.language),
-                joinedload(common.UnitValue.unitparameter))
+        query = self.search_fulltext(query).options(
+            selectinload(CounterpartSearch.counterpart)
+            .joinedload(common.UnitValue.unit)
+            .joinedload(common.Unit.language))
 
         if self.unit:
-            return query.filter(common.UnitValue.unit_pk == self.unit.pk)
+            return query.filter(CounterpartSearch.unit_pk == self.unit.pk)
 
         if self.unitparameter:
-            return query.filter(
-                common.UnitValue.unitparameter_pk == self.unitparameter.pk)
+            return query.filter(CounterpartSearch.unitparameter_pk == self.unitparameter.pk)
 
         if self.contribution:
-            return query.filter(common.UnitValue.contribution_pk == self.contribution.pk)
+            return query.filter(CounterpartSearch.contribution_pk == self.contribution.pk)
 
         return query
 
@@ -139,37 +415,45 @@ class Counterparts(Unitvalues):
 
     def col_defs(self):
         return [
-            DetailsRowLinkCol(self, '#'),
+            DetailsRowLinkCol(self, '#', get_object=lambda i: i.counterpart),
             WordCol(
                 self,
                 'form',
-                get_obj=lambda i: i.unit,
-                model_col=common.Unit.name),
-            VariantCol(self, 'variant', get_object=lambda u: u.unit),
-            Col(
-                self,
-                'english',
-                get_obj=lambda i: i.unitparameter,
-                model_col=common.UnitParameter.name),
-            Col(
-                self,
-                'russian',
-                get_obj=lambda i: i.unitparameter,
-                model_col=Meaning.russian),
-            Col(self, 'pos', get_object=lambda u: u.unit, model_col=Entry.pos),
-            Col(self, 'aspect', get_object=lambda u: u.unit, model_col=Entry.aspect),
-            Col(self, 'plural', get_object=lambda u: u.unit, model_col=Entry.plural),
+                get_obj=lambda i: i.counterpart.unit,
+                model_col=CounterpartSearch.form,
+                normalized=CounterpartSearch.normalized),
+            VariantCol(self, 'variant', model_col=CounterpartSearch.variant),
+            Col(self, 'english', model_col=CounterpartSearch.english),
+            Col(self, 'russian', model_col=CounterpartSearch.russian),
+            Col(self, 'pos', model_col=CounterpartSearch.pos),
+            Col(self, 'aspect', model_col=CounterpartSearch.aspect),
+            Col(self, 'plural', model_col=CounterpartSearch.plural),
             Col(
                 self,
                 'donor',
-                choices=get_distinct_values(Entry.donor),
-                get_object=lambda u: u.unit,
-                model_col=Entry.donor),
+                choices=util.distinct_values(self.req, Entry.donor),
+                model_col=CounterpartSearch.donor),
             DialectCol(
                 self,
                 'variety',
-                get_object=lambda u: u.unit.language,
-                choices=[(l.id, l.name) for l in DBSession.query(common.Language)]),
+                get_object=lambda i: i.counterpart.unit.language,
+                language_pk=CounterpartSearch.language_pk),
+        ]
+
+    def download_cols(self):
+        return [
+            ('id', select([common.UnitValue.id])
+                .where(common.UnitValue.pk == CounterpartSearch.pk)
+                .scalar_subquery()),
+            ('form', CounterpartSearch.form),
+            ('variant', CounterpartSearch.variant),
+            ('english', CounterpartSearch.english),
+            ('russian', CounterpartSearch.russian),
+            ('pos', CounterpartSearch.pos),
+            ('aspect', CounterpartSearch.aspect),
+            ('plural', CounterpartSearch.plural),
+            ('donor', CounterpartSearch.donor),
+            ('variety', language_name(CounterpartSearch.language_pk)),
         ]
 
 
@@ -0,0 +1,156 @@
+"""
+Full-text search over entries, meanings and example sentences.
+
+The index is built by `prime_cache` - as FTS5 table on SQLite, as table with `tsvector`
+column and GIN index on PostgreSQL. Texts and queries are folded - i.e. stripped of
+diacritics and casefolded, forms are normalized - and query words match as prefixes of
+indexed words.
+"""
+import re
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, Unicode, select, insert, func, text, literal_column,
+    bindparam, false, inspect,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from zope.sqlalchemy import mark_changed
+from clld.db.meta import DBSession
+from clld.db.models import common
+from clld.db import fts
+
+from cdk.models import Entry, Meaning
+from cdk.util import fold, normalize, MARKS, LETTERS
+
+# Types of indexed objects - which are also the names of their routes:
+TYPES = ['unit', 'unitparameter', 'sentence']
+FIELDS = ['form', 'english', 'russian', 'german', 'text']
+WORD = re.compile(r'\w+')
+
+# Not part of the metadata of the models, because the table is created by `build_index`.
+FULLTEXT = Table(
+    'fulltext',
+    MetaData(),
+    Column('type', Unicode),
+    Column('pk', Integer),
+    Column('id', Unicode),
+    Column('label', Unicode),
+    # Indexed fields on SQLite:
+    *[Column(name, Unicode) for name in FIELDS] +
+    # Indexed document on PostgreSQL:
+    [Column('doc', TSVECTOR)])
+
+
+def is_postgresql():
+    return DBSession.bind.dialect.name == 'postgresql'
+
+
+def has_index():
+    """
+    Whether the index has been built - which `prime_cache` may not have done yet.
+    """
+    return inspect(DBSession.connection()).has_table(FULLTEXT.name)
+
+
+def documents():
+    """
+    :return: Generator of `dict`s, the rows of the index.
+    """
+    for pk, id_, name in DBSession.query(Entry.pk, Entry.id, Entry.name):
+        yield dict(type='unit', pk=pk, id=id_, label=name, form=normalize(name))
+
+    for pk, id_, name, english, russian, german in DBSession.query(
+            Meaning.pk, Meaning.id, Meaning.name,
+            Meaning.english, Meaning.russian, Meaning.german):
+        yield dict(
+            type='unitparameter', pk=pk, id=id_, label=name,
+            english=fold(english), russian=fold(russian), german=fold(german))
+
+    for pk, id_, name, description in DBSession.query(
+            common.Sentence.pk, common.Sentence.id, common.Sentence.name,
+            common.Sentence.description):
+        yield dict(
+            type='sentence', pk=pk, id=id_, label=name,
+            text=fold('{0} {1}'.format(name or '', description or '')))
+
+
+def build_index(chunksize=5000):
+    """
+    (Re-)create the full-text index.
+
+    :return: Number of indexed objects.
+    """
+    postgresql = is_postgresql()
+    DBSession.execute(text('DROP TABLE IF EXISTS fulltext'))
+    if postgresql:  # pragma: no cover
+        FULLTEXT.create(DBSession.connection())
+        fts.index('fulltext_doc', FULLTEXT.c.doc, DBSession.connection())
+        stmt = insert(FULLTEXT).values(doc=func.to_tsvector('simple', bindparam('document')))
+    else:
+        DBSession.execute(text(
+            'CREATE VIRTUAL TABLE fulltext USING fts5('
+            'type UNINDEXED, pk UNINDEXED, id UNINDEXED, label UNINDEXED, {0}, '
+            'tokenize="unicode61 remove_diacritics 2")'.format(', '.join(FIELDS))))
+        stmt = insert(FULLTEXT)
+
+    n, rows = 0, []
+    for row in documents():
+        if postgresql:  # pragma: no cover
+            row = dict(
+                {k: v for k, v in row.items() if k not in FIELDS},
+                document=' '.join(row[k] for k in FIELDS if row.get(k)))
+        else:
+            row = dict({name: None for name in FIELDS}, **row)
+        rows.append(row)
+        if len(rows) >= chunksize:
+            DBSession.execute(stmt, rows)
+            n, rows = n + len(rows), []
+    if rows:
+        DBSession.execute(stmt, rows)
+        n += len(rows)
+    mark_changed(DBSession())
+    return n
+
+
+def match(qs):
+    """
+    :return: Clause matching rows of the index with all words of `qs` - or `None` if `qs` \
+    contains no words.
+    """
+    # Query words are normalized like forms - see `cdk.util.normalize` - but keep digits:
+    words = WORD.findall(fold(MARKS.sub('', qs)).translate(LETTERS))
+    if not words:
+        return None
+    if is_postgresql():  # pragma: no cover
+        return FULLTEXT.c.doc.op('@@')(
+            func.to_tsquery('simple', ' & '.join('{0}:*'.format(w) for w in words)))
+    return literal_column('fulltext').op('MATCH')(
+        ' '.join('"{0}"*'.format(w) for w in words))
+
+
+def matches(qs, type_):
+    """
+    :return: Select of the pks of objects of type `type_` matching `qs`.
+    """
+    clause = match(qs)
+    return select([FULLTEXT.c.pk])\
+        .where(FULLTEXT.c.type == type_)\
+        .where(clause if clause is not None else false())
+
+
+def search(qs, type_=None, limit=50):
+    """
+    :return: `list` of `dict`s describing the best `limit` matches for `qs`.
+    """
+    clause = match(qs)
+    if clause is None or not has_index():
+        return []
+    query = select([FULLTEXT.c.type, FULLTEXT.c.id, FULLTEXT.c.label]).where(clause)
+    if type_:
+        query = query.where(FULLTEXT.c.type == type_)
+    if is_postgresql():  # pragma: no cover
+        query = query.order_by(func.ts_rank(FULLTEXT.c.doc, clause.right).desc())
+    else:
+        query = query.order_by(literal_column('rank'))
+    return [
+        dict(type=type_, id=id_, label=label)
+        for type_, id_, label in DBSession.execute(query.limit(limit))]
@@ -2,24 +2,32 @@ from itertools import groupby
 
 from zope.interface import implementer
 from sqlalchemy import (
+    select,
     Column,
     Unicode,
     Integer,
     Boolean,
     ForeignKey,
+    UniqueConstraint,
+    Index,
 )
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declared_attr
 
 from clld import interfaces
 from clld.db.meta import Base, CustomModelMixin
-from clld.db.models.common import Unit, Sentence, UnitParameter, UnitValue
+from clld.db.models.common import (
+    Unit, Sentence, UnitParameter, UnitValue, SentenceReference, Language,
+)
+
+# The examples datatable filters sentences by source:
+Index('sentencereference_sentence_pk', SentenceReference.__table__.c.sentence_pk)
 
 
 class CounterpartExample(Base):
-    unitvalue_pk = Column(Integer, ForeignKey('unitvalue.pk'))
-    sentence_pk = Column(Integer, ForeignKey('sentence.pk'))
-    location = Column(Unicode())
+    unitvalue_pk = Column(Integer, ForeignKey('unitvalue.pk'), index=True)
+    sentence_pk = Column(Integer, ForeignKey('sentence.pk'), index=True)
+    location = Column(Unicode(), index=True)
 
     @declared_attr
     def sentence(cls):
@@ -34,33 +42,50 @@ class CounterpartExample(Base):
             backref=backref('examples', order_by=[cls.location, cls.sentence_pk]))
 
 
+class VariantGroup(Base):
+    """
+    A group of entries which are dialectal variants of each other, i.e. the entries
+    created from one headword.
+    """
+
+
 @implementer(interfaces.IUnit)
 class Entry(CustomModelMixin, Unit):
     pk = Column(Integer, ForeignKey('unit.pk'), primary_key=True)
 
     variant = Column(Boolean, nullable=False)
+    # The form, normalized for lookup - see `cdk.util.normalize`:
+    normalized = Column(Unicode)
     donor = Column(Unicode)
     disambiguation = Column(Unicode)
     pos = Column(Unicode)
     aspect = Column(Unicode)
     plural = Column(Unicode)
+    variantgroup_pk = Column(Integer, ForeignKey('variantgroup.pk'), index=True)
+
+    @declared_attr
+    def variantgroup(cls):
+        # The entries of a group are ordered as displayed - by name of their language:
+        return relationship(
+            VariantGroup,
+            backref=backref('entries', order_by=lambda: [
+                select([Language.name])
+                .where(Language.pk == Entry.language_pk)
+                .scalar_subquery(),
+                Entry.pk]))
 
     @property
     def variants(self):
-        res = []
-        vars = [v.entry2 for v in self.variants1] + [v.entry1 for v in self.variants2]
-        for lang, vars in groupby(
-                sorted(vars, key=lambda v: v.language.name), lambda v: v.language.name):
-            res.append((lang, list(vars)))
-        return res
-
-
-class Variants(Base):
-    entry1_pk = Column(Integer, ForeignKey('unit.pk'))
-    entry2_pk = Column(Integer, ForeignKey('unit.pk'))
-
-    entry1 = relationship(Entry, foreign_keys=[entry1_pk], backref='variants1')
-    entry2 = relationship(Entry, foreign_keys=[entry2_pk], backref='variants2')
+        """
+        :return: `list` of pairs `(language name, list of entries)` for the other entries \
+        of the variant group.
+        """
+        if self.variantgroup is None:
+            return []
+        return [
+            (lang, list(entries)) for lang, entries in groupby(
+                [e for e in self.variantgroup.entries if e.pk != self.pk],
+                lambda e: e.language.name)]
 
 
 @implementer(interfaces.IUnitParameter)
@@ -69,3 +94,50 @@ class Meaning(CustomModelMixin, UnitParameter):
     english = Column(Unicode)
     russian = Column(Unicode)
     german = Column(Unicode)
+
+
+class HeadwordGroup(Base):
+    """
+    Bookkeeping for incremental imports: The rows for one headword in one of the CSV
+    tables, with a hash of their content. The ids of the entries created from these rows
+    are stored as list in `jsondata['entries']`.
+    """
+    __table_args__ = (UniqueConstraint('csv', 'key'),)
+
+    csv = Column(Unicode, nullable=False)
+    key = Column(Unicode, nullable=False)
+    hash = Column(Unicode, nullable=False)
+
+
+class CounterpartSearch(Base):
+    """
+    Denormalized data of counterparts - i.e. `UnitValue` objects - for filtering and
+    sorting in the counterparts datatable without joins. Filled by `prime_cache`; the
+    primary key is the primary key of the counterpart.
+    """
+    pk = Column(Integer, ForeignKey('unitvalue.pk'), primary_key=True)
+    unit_pk = Column(Integer, index=True)
+    unitparameter_pk = Column(Integer, index=True)
+    contribution_pk = Column(Integer, index=True)
+    language_pk = Column(Integer, index=True)
+    form = Column(Unicode, index=True)
+    normalized = Column(Unicode)
+    variant = Column(Boolean, index=True)
+    english = Column(Unicode, index=True)
+    russian = Column(Unicode, index=True)
+    pos = Column(Unicode, index=True)
+    aspect = Column(Unicode, index=True)
+    plural = Column(Unicode, index=True)
+    donor = Column(Unicode, index=True)
+
+    counterpart = relationship(UnitValue)
+
+
+# Normalized forms are searched by prefix - see `cdk.datatables.WordCol`. On PostgreSQL this
+# is done with LIKE, which can only use an index with operator class `text_pattern_ops` if
+# the database collation isn't "C":
+for _table in [Entry.__table__, CounterpartSearch.__table__]:
+    Index(
+        'ix_{0}_normalized'.format(_table.name),
+        _table.c.normalized,
+        postgresql_ops={'normalized': 'text_pattern_ops'})
@@ -0,0 +1,210 @@
+# coding: utf8
+"""
+Benchmark the functions parsing the dictionary data.
+
+    python -m cdk.scripts.benchmark [--synthetic [--size N]] [--save FILE] [--compare FILE]
+        [CSV ...]
+
+By default the strings are read from the CSV tables in the data directory - or from the
+given CSV tables. With `--synthetic` a corpus of `--size` headwords and example strings is
+generated from the sample rows in `cdk.scripts.samples` instead.
+
+Throughput is reported in strings per second. With `--save` the results are written to a
+JSON file, which can serve as baseline for later runs with `--compare` - exiting with
+status 1 if any function got slower than the baseline by more than `--tolerance`. Note
+that results are only comparable when measured on the same, otherwise idle, machine.
+"""
+from __future__ import unicode_literals, print_function, division
+import io
+import sys
+import json
+import random
+import timeit
+import argparse
+import platform
+import contextlib
+from collections import OrderedDict
+
+from csvw.dsv import UnicodeReader
+from clld.cliutil import data_file
+
+import cdk
+from cdk import util as cdk_util
+from cdk.scripts import util
+from cdk.scripts.samples import NOUNS, VERBS
+from cdk.scripts.initializedb import TABLES
+
+
+def iter_rows(fnames):
+    for fname in fnames:
+        with UnicodeReader(fname) as reader:
+            for row in reader:
+                if len(row) == 7:
+                    yield row
+
+
+def corpus_from_rows(rows):
+    headwords, descriptions = [], []
+    for row in rows:
+        if row[0].strip() and row[0] != 'lemma':
+            headwords.append(row[0])
+        if row[6].strip():
+            descriptions.append(row[6].strip())
+    return corpus(headwords, descriptions)
+
+
+def synthetic_corpus(size, seed=1):
+    """
+    Generate `size` headwords and example strings by recombining the parts of the
+    headwords and examples in the sample rows.
+    """
+    rows = NOUNS[1:] + VERBS
+    rnd = random.Random(seed)
+    forms = sorted(set(util.Headword(row[0]).form for row in rows))
+    examples = []
+    for row in rows:
+        chunks = [(ss or '').strip() for ss in util.split_locations(row[6])]
+        examples.extend(
+            '{0}. {1}'.format(loc, text) for loc, text in zip(chunks[2::3], chunks[3::3]))
+    sources = ['', '', ' (КФТ: {0})', ' (СНСС72: {0})', ' (WER1: {0})']
+    dialects = sorted(util.DIALECTS)
+
+    def variants():
+        ds = rnd.sample(dialects, rnd.randint(1, len(dialects)))
+        if rnd.random() < 0.3:
+            return ' ({0}.)'.format(ds[0])
+        return ' ({0})'.format(', '.join(
+            '{0}. {1}'.format(d, rnd.choice(forms)) for d in ds))
+
+    headwords, descriptions = [], []
+    for _ in range(size):
+        headwords.append(''.join([
+            rnd.choice(forms),
+            rnd.choice(['', '', '1', '2']),
+            rnd.choice(['', '', '', ' <rus.>', ' <selk.>']),
+            variants() if rnd.random() < 0.4 else '',
+            rnd.choice(['', '', '', ' I', ' II']),
+        ]))
+        descriptions.append(', '.join(
+            rnd.choice(examples) + rnd.choice(sources).format(rnd.randint(1, 500))
+            for _ in range(rnd.randint(1, 6))))
+    return corpus(headwords, descriptions)
+
+
+def corpus(headwords, descriptions):
+    brackets = []
+    for headword in headwords:
+        match = util.VARIANTS_PATTERN.search(headword)
+        if match:
+            brackets.append(headword[match.start():])
+    return dict(
+        headwords=headwords,
+        brackets=brackets,
+        variants=[util.in_brackets(s)[0] for s in brackets],
+        descriptions=descriptions)
+
+
+@contextlib.contextmanager
+def regex_splitting():
+    split_locations = util.split_locations
+    util.split_locations = util.LOC_PATTERN.split
+    try:
+        yield
+    finally:
+        util.split_locations = split_locations
+
+
+def yield_examples_regex(strings):
+    with regex_splitting():
+        return [list(util.yield_examples(s)) for s in strings]
+
+
+BENCHMARKS = OrderedDict([
+    # name: (function, key of the input strings in the corpus)
+    ('Headword', (lambda ss: [util.Headword(s) for s in ss], 'headwords')),
+    ('in_brackets', (lambda ss: [util.in_brackets(s) for s in ss], 'brackets')),
+    ('yield_variants', (lambda ss: [list(util.yield_variants(s)) for s in ss], 'variants')),
+    ('split_locations', (lambda ss: [util.split_locations(s) for s in ss], 'descriptions')),
+    ('LOC_PATTERN.split', (lambda ss: [util.LOC_PATTERN.split(s) for s in ss], 'descriptions')),
+    ('yield_examples', (lambda ss: [list(util.yield_examples(s)) for s in ss], 'descriptions')),
+    ('yield_examples (regex)', (yield_examples_regex, 'descriptions')),
+    ('form', (lambda ss: [cdk_util.form(s) for s in ss], 'headwords')),
+])
+
+
+def run(corpus, repeat=5):
+    """
+    :return: `OrderedDict` mapping benchmark names to throughput in strings per second.
+    """
+    res = OrderedDict()
+    for name, (func, key) in BENCHMARKS.items():
+        strings = corpus[key]
+        if strings:
+            timer = timeit.Timer(lambda: func(strings))
+            # Run fast functions repeatedly, to get measurements of at least 0.2s:
+            number, _ = timer.autorange()
+            secs = min(timer.repeat(number=number, repeat=repeat)) / number
+            res[name] = len(strings) / secs
+    return res
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    :return: `list` of names of the benchmarks which are slower than the baseline by more \
+    than `tolerance`.
+    """
+    return [
+        name for name, throughput in results.items()
+        if name in baseline and throughput < baseline[name] * (1 - tolerance)]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument(
+        'csv', nargs='*',
+        help='CSV tables to read the strings from - by default the tables in the data directory')
+    parser.add_argument(
+        '--synthetic', action='store_true', help='benchmark with a synthetic corpus')
+    parser.add_argument('--size', type=int, default=10000, help='size of synthetic corpus')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE', help='save results as baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare results with baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(args)
+
+    if args.synthetic:
+        strings = synthetic_corpus(args.size, seed=args.seed)
+    else:
+        args.csv = args.csv or [str(data_file(cdk, fname)) for fname, _ in TABLES]
+        strings = corpus_from_rows(iter_rows(args.csv))
+    baseline = {}
+    if args.compare:
+        with io.open(args.compare, encoding='utf8') as fp:
+            baseline = json.load(fp)['results']
+
+    results = run(strings, repeat=args.repeat)
+    print('{0:<24} {1:>8} {2:>14} {3:>10}'.format('function', 'strings', 'strings/s', 'baseline'))
+    for name, throughput in results.items():
+        print('{0:<24} {1:>8} {2:>14.0f} {3:>10}'.format(
+            name,
+            len(strings[BENCHMARKS[name][1]]),
+            throughput,
+            '{0:.2f}x'.format(throughput / baseline[name]) if name in baseline else ''))
+
+    if args.save:
+        with io.open(args.save, 'w', encoding='utf8') as fp:
+            json.dump(dict(
+                python=platform.python_version(),
+                corpus=dict(size=args.size, seed=args.seed) if args.synthetic else args.csv,
+                results=results), fp, indent=2)
+
+    slower = compare(results, baseline, tolerance=args.tolerance)
+    if slower:
+        print('slower than baseline: {0}'.format(', '.join(slower)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+# coding: utf8
+"""
+Benchmark the queries of the datatables - paging, sorting and filtering.
+
+    python -m cdk.scripts.benchmark_datatables [--db URL] [--size N] [--keyset]
+
+An empty db - or, without `--db`, a SQLite db in a temporary directory - is populated
+with a synthetic corpus of `--size` headwords first (see `cdk.scripts.benchmark`).
+
+With `--keyset` the datatables use keyset pagination; deep pages are then timed as if
+reached by paging forward, i.e. with the cursor of the previous page known.
+"""
+from __future__ import unicode_literals, print_function, division
+import os
+import sys
+import shutil
+import timeit
+import functools
+import argparse
+import tempfile
+import contextlib
+from collections import OrderedDict
+
+import transaction
+from sqlalchemy import create_engine, inspect
+from pyramid import testing
+from clld.cliutil import Data
+from clld.db.meta import DBSession, Base
+from clld.db.models import common
+
+from cdk import models, datatables, util as cdk_util
+from cdk.scripts import util
+from cdk.scripts.writer import BulkWriter
+from cdk.scripts.benchmark import synthetic_corpus
+
+
+def populate(size, seed=1):
+    """
+    Load a synthetic corpus into the db bound to `DBSession`.
+    """
+    corpus = synthetic_corpus(size, seed=seed)
+    data = Data()
+    DBSession.add(common.Dataset(id='cdk', name='CDK', domain='cdk.clld.org'))
+    contrib = common.Contribution(id='ket', name='CDK')
+    ket = data.add(common.Language, 'ket', id='ket', name='Ket')
+    for abbr, name in util.DIALECTS.items():
+        data.add(common.Language, abbr, id=abbr, name=name)
+    sources = set(
+        util.SOURCE_MAP.get(m.group('src'), m.group('src'))
+        for s in corpus['descriptions'] for m in util.SOURCE_MARKER.finditer(s))
+    for i, src in enumerate(sorted(sources)):
+        data.add(common.Source, src, id=str(i + 1), name=src)
+
+    pos = sorted(p for p in util.POS if p)
+    rows = [
+        # Make the example sentences - text followed by two spaces - of each headword unique:
+        [hw, pos[i % len(pos)], '', 'слово %s' % i, 'Wort %s' % i, 'word %s' % i,
+         desc.replace('  ', ' %s  ' % i)]
+        for i, (hw, desc) in enumerate(zip(corpus['headwords'], corpus['descriptions']))]
+    ctx = util.ImportContext(data, BulkWriter(data))
+    util.load(ctx, iter(rows), ket, contrib, verbs=False)
+    ctx.writer.close()
+    util.fill_counterpart_search()
+    cdk_util.set_data_version()
+    DBSession.flush()
+
+
+def request(**params):
+    req = testing.DummyRequest(params=params)
+    req.translate = lambda s: s
+    req.resource_url = lambda *args, **kw: '#'
+    req.data_version = cdk_util.data_version()
+    return req
+
+
+def scenarios():
+    """
+    :return: `OrderedDict` mapping scenario names to (datatable class, model, params).
+    """
+    page = dict(iDisplayLength='100')
+    res = OrderedDict()
+    for cls, model, cols in [
+        (datatables.Examples, common.Sentence, dict(sort=2, location=2, source=3)),
+        (datatables.Counterparts, models.CounterpartSearch, dict(sort=1, form=1, english=3, donor=8, variety=9)),
+        (datatables.Entries, models.Entry, dict(sort=0, form=0, pos=2, variety=6)),
+    ]:
+        name = cls.__name__
+        res[name + ': first page'] = (cls, model, page)
+        res[name + ': page 50'] = (cls, model, dict(page, iDisplayStart='5000'))
+        res[name + ': sorted'] = (
+            cls, model, dict(page, iSortingCols='1', iSortCol_0=str(cols.pop('sort'))))
+        res.update(filters(name, cls, model, cols, page))
+    return res
+
+
+def filters(name, cls, model, cols, page):
+    """Filter values are picked from the data, so that filters match something."""
+    values = dict(
+        location=lambda: DBSession.query(models.CounterpartExample.location).first()[0],
+        source=lambda: DBSession.query(common.Source.name).first()[0],
+        english=lambda: DBSession.query(models.Meaning.english).first()[0][:4],
+        form=lambda: DBSession.query(models.Entry.name).first()[0][:3],
+        donor=lambda: 'Russian',
+        pos=lambda: DBSession.query(models.Entry.pos).first()[0],
+        variety=lambda: 'sket',
+    )
+    for col, index in sorted(cols.items()):
+        yield '{0}: filtered by {1}'.format(name, col), (
+            cls, model, dict(page, **{'sSearch_%s' % index: values[col]()}))
+
+
+def run(repeat=5, match=None):
+    res = OrderedDict()
+    for name, (cls, model, params) in scenarios().items():
+        if match and match not in name:
+            continue
+        def query(**params):
+            # Like a JSON request of the datatable: counts plus one page of formatted items.
+            dt = cls(request(**params), model)
+            return [[col.format(item) for col in dt.cols] for item in dt.get_query()]
+
+        if 'iDisplayStart' in params:
+            # Request the previous page - which stores the cursor for keyset pagination:
+            query(**dict(
+                params,
+                iDisplayStart=str(int(params['iDisplayStart']) - int(params['iDisplayLength']))))
+        query = functools.partial(query, **params)
+        timer = timeit.Timer(query)
+        number, _ = timer.autorange()
+        res[name] = min(timer.repeat(number=number, repeat=repeat)) / number
+    return res
+
+
+@contextlib.contextmanager
+def session(url, keyset=False):
+    DBSession.remove()
+    DBSession.configure(bind=create_engine(url))
+    testing.setUp(settings={'cdk.keyset_pagination': keyset})
+    yield
+    testing.tearDown()
+    DBSession.remove()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--db', help='SQLAlchemy URL of a populated db')
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keyset', action='store_true', help='use keyset pagination')
+    parser.add_argument('-k', help='only run scenarios with names containing the string')
+    args = parser.parse_args(args)
+
+    tmp = None
+    if not args.db:
+        tmp = tempfile.mkdtemp()
+        args.db = 'sqlite:///' + os.path.join(tmp, 'cdk.sqlite')
+    try:
+        with session(args.db, keyset=args.keyset):
+            if not inspect(DBSession.bind).has_table('unit'):
+                Base.metadata.create_all(DBSession.bind)
+                populate(args.size)
+                transaction.commit()
+            for name, secs in run(repeat=args.repeat, match=args.k).items():
+                print('{0:<40} {1:>10.1f} ms'.format(name, secs * 1000))
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,55 @@
+"""
+Export the dictionary as CLDF Dictionary.
+
+    python -m cdk.scripts.export_cldf development.ini OUTPUT
+
+If OUTPUT ends with `.zip` the dataset is written to a zip archive, otherwise to the
+directory OUTPUT.
+"""
+from __future__ import unicode_literals, print_function, division
+import sys
+import time
+import pathlib
+import zipfile
+import argparse
+import contextlib
+
+from clld.cliutil import AppConfig, SessionContext
+
+from cdk import cldf
+
+
+@contextlib.contextmanager
+def opener(output):
+    """
+    :return: Context manager yielding a function to open files in `output` for writing.
+    """
+    output = pathlib.Path(output)
+    if output.suffix == '.zip':
+        with zipfile.ZipFile(str(output), 'w') as zipf:
+            yield cldf.zip_opener(zipf)
+    else:
+        if not output.exists():
+            output.mkdir(parents=True)
+        yield lambda name: output.joinpath(name).open('wb')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('config_uri', action=AppConfig, help='ini file providing app config')
+    parser.add_argument('output', help='directory or zip file to write the dataset to')
+    parser.add_argument('--chunksize', type=int, default=1000)
+    args = parser.parse_args(args)
+
+    start = time.perf_counter()
+    with SessionContext(args.settings):
+        with opener(args.output) as open_:
+            stats = cldf.write(open_, chunksize=args.chunksize)
+    for fname, n in stats.items():
+        print('{0:<16} {1:>8} rows'.format(fname, n))
+    print('written in {0:.1f} secs'.format(time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,123 @@
+import os
 import sys
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 
-from clld.cliutil import Data, add_language_codes
+import transaction
+from pyramid.scripting import prepare
+from pyramid.request import Request
+from pyramid.interfaces import IRequestFactory
+from pyramid.renderers import render
+from clld.web.app import ctx_factory
+from clld.cliutil import Data, add_language_codes, BootstrappedAppConfig, SessionContext
 from clld.db.meta import DBSession
 from clld.db.models import common
 from csvw.dsv import UnicodeReader
 
 import cdk
-from cdk.scripts.util import load, DIALECTS, PROBLEMS
+from cdk.util import set_data_version, FRAGMENTS
+from cdk.fts import build_index
+from cdk import snapshots
+from cdk.scripts.util import (
+    load, update_groups, delete_orphans, DIALECTS, ProblemLog, ImportContext, ParseCache,
+    iter_chunks, fill_counterpart_search,
+)
+from cdk.scripts.writer import OrmWriter, BulkWriter
+from cdk.scripts.timing import Timer, profiled
+
+TABLES = [
+    # (CSV file name, whether the table lists verbs)
+    ('Ket_nouns_and_other_pos_table.docx.csv', False),
+    ('Ket_verbs_table.docx.csv', True),
+]
+
+
+def get_option(args, name, default=None):
+    """Import options are read from environment variables or the app config.
+
+    E.g. the option `import_mode` can be set via environment variable `CDK_IMPORT_MODE`
+    or as `cdk.import_mode` in the ini file.
+    """
+    return os.environ.get(
+        'CDK_' + name.upper(),
+        (getattr(args, 'settings', None) or {}).get('cdk.' + name, default))
+
+
+@contextlib.contextmanager
+def parse_executor(args):
+    """
+    Parsing of the headword groups can be distributed over a pool of processes, while
+    loading the results into the db is done in the main process.
+    """
+    workers = int(get_option(args, 'import_workers', 0))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            yield executor
+    else:
+        yield None
+
+
+def parse_cache(args):
+    """
+    Parse results can be cached across imports in the SQLite db given as option
+    `import_cache`.
+    """
+    fname = get_option(args, 'import_cache')
+    return ParseCache(fname) if fname else None
+
+
+def close_cache(cache):
+    if cache is not None:
+        print('{0} parse results cached, {1} new'.format(len(cache), cache.added))
+        cache.close()
+
+
+def import_timer(args):
+    """
+    With option `import_timing` set, the stages of the import are timed. If the value is
+    the name of a JSON file, the stats are also written to this file.
+    """
+    return Timer(enabled=bool(get_option(args, 'import_timing')))
+
+
+def report_timing(args, timer):
+    """
+    Report the stats of `timer` - including the time it takes to commit the import - once
+    the current transaction has been committed.
+    """
+    if not timer.enabled:
+        return
+    fname, start = get_option(args, 'import_timing'), []
+
+    def after_commit(success):
+        if start:
+            timer.add('commit', 1, time.perf_counter() - start[0])
+        print(timer.report())
+        if fname.endswith('.json'):
+            timer.write(fname)
+
+    txn = transaction.get()
+    txn.addBeforeCommitHook(lambda: start.append(time.perf_counter()))
+    txn.addAfterCommitHook(after_commit)
+
+
+def print_peak_memory():
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS, in kilobytes elsewhere.
+    print('peak memory: {0:.0f} MB'.format(
+        maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)))
+
+
+def print_problems(problems):
+    print('parsing problematic in %s cases:' % len(problems))
+    for (stage, category), n in sorted(problems.counts.items()):
+        print('{0:>6}  {1}: {2}'.format(n, stage, category))
 
 
 def main(args):
@@ -46,7 +157,7 @@ def main(args):
         data.add(common.Language, abbr, id=abbr, name=name)
 
     with args.data_file('sources.txt').open(encoding='utf8') as fp:
-        for i, chunk in enumerate(fp.read().split('\n\n\n')):
+        for i, chunk in enumerate(iter_chunks(fp, '\n\n\n')):
             try:
                 id_, year, author, desc = chunk.split('\n')
             except:
@@ -61,13 +172,78 @@ def main(args):
                 year=year,
                 description=desc)
 
-    with UnicodeReader(args.data_file('Ket_nouns_and_other_pos_table.docx.csv')) as reader:
-        load(data, reader, ket, contrib, verbs=False)
+    # Choose between creating ORM objects (import_mode "orm") and bulk inserts
+    # ("bulk") - both yield the same database.
+    if get_option(args, 'import_mode', 'orm') == 'bulk':
+        writer = BulkWriter(data, chunksize=int(get_option(args, 'import_chunksize', 5000)))
+    else:
+        writer = OrmWriter(data)
+    ctx = ImportContext(
+        data,
+        writer,
+        ProblemLog('context-problems.jsonl'),
+        cache=parse_cache(args),
+        timer=import_timer(args))
+
+    # With option `import_profile` set, the import is profiled, writing pstats to the
+    # given file.
+    with profiled(get_option(args, 'import_profile')):
+        with parse_executor(args) as executor:
+            for fname, verbs in TABLES:
+                with UnicodeReader(args.data_file(fname)) as reader:
+                    load(ctx, reader, ket, contrib, verbs=verbs, executor=executor)
+
+        with ctx.timer('final flush'):
+            ctx.writer.close()
+    close_cache(ctx.cache)
+    ctx.problems.flush()
+    print_problems(ctx.problems)
+    print_peak_memory()
+    report_timing(args, ctx.timer)
+
+
+def update(args):
+    """
+    Incrementally update an existing database with the changes in the CSV tables.
+
+    Only headwords whose rows changed since the last import are reloaded - keeping the IDs
+    of all other objects stable. Run as
+
+        python cdk/scripts/initializedb.py development.ini
+    """
+    data = Data()
+    for lang in DBSession.query(common.Language):
+        data['Language'][lang.id] = lang
+    for src in DBSession.query(common.Source):
+        data['Source'][src.name] = src
+    ket, contrib = data['Language']['ket'], common.Contribution.get('ket')
+    ctx = ImportContext.from_db(
+        data,
+        BulkWriter(data),
+        ProblemLog('context-problems.jsonl'),
+        cache=parse_cache(args),
+        timer=import_timer(args))
 
-    with UnicodeReader(args.data_file('Ket_verbs_table.docx.csv')) as reader:
-        load(data, reader, ket, contrib)
+    with profiled(get_option(args, 'import_profile')):
+        with parse_executor(args) as executor:
+            for fname, verbs in TABLES:
+                with UnicodeReader(args.data_file(fname)) as reader:
+                    stats = update_groups(
+                        ctx, reader, ket, contrib, verbs=verbs, executor=executor)
+                print('{0}: {1}'.format(
+                    fname, ', '.join('{0} {1}'.format(v, k) for k, v in sorted(stats.items()))))
 
-    print('parsing examples problematic in %s cases' % len(PROBLEMS))
+        with ctx.timer('final flush'):
+            ctx.writer.close()
+        with ctx.timer('delete orphans'):
+            orphans = delete_orphans()
+    close_cache(ctx.cache)
+    for table, n in sorted(orphans.items()):
+        print('{0} orphaned rows deleted from {1}'.format(n, table))
+    ctx.problems.flush()
+    print_problems(ctx.problems)
+    print_peak_memory()
+    report_timing(args, ctx.timer)
 
 
 def prime_cache(args):
@@ -75,3 +251,66 @@ def prime_cache(args):
     This procedure should be separate from the db initialization, because
     it will have to be run periodically whenever data has been updated.
     """
+    print('{0} counterparts indexed for search'.format(fill_counterpart_search()))
+    print('{0} objects indexed for full-text search'.format(build_index()))
+    # Invalidate the data cached by the app:
+    version = set_data_version()
+    print('{0} pages rendered for the fragment cache'.format(warm_fragment_cache(args)))
+    for type_, n in write_snapshots(args, version).items():
+        print('{0} snapshots of {1} objects written'.format(n, type_))
+
+
+def warm_fragment_cache(args):
+    """
+    Render the detail pages of entries and examples and the snippets of counterparts to
+    fill the on-disk fragment cache - if one is configured as `cdk.fragment_cache_dir`.
+
+    Fragments contain absolute links and are cached per host, so they are rendered for the
+    public URL of the app - configured as `cdk.public_url` or derived from the domain of
+    the dataset.
+
+    The templates are rendered with the registry of the app bootstrapped by the command -
+    see `clld.cliutil.BootstrappedAppConfig` - and the session of the import.
+    """
+    if not (args.settings or {}).get('cdk.fragment_cache_dir'):
+        return 0
+    base_url = get_option(
+        args, 'public_url', 'https://' + DBSession.query(common.Dataset.domain).scalar())
+    registry = args.env['registry']
+    req = registry.queryUtility(IRequestFactory, default=Request).blank('/', base_url=base_url)
+    env = prepare(request=req, registry=registry)
+    FRAGMENTS.clear()
+    n = 0
+    for model, template in [
+        (common.Unit, 'unit/detail_html.mako'),
+        (common.Sentence, 'sentence/detail_html.mako'),
+        (common.UnitValue, 'unitvalue/snippet_html.mako'),
+    ]:
+        for id_, in DBSession.query(model.id).order_by(model.pk):
+            req.matchdict = {'id': id_}
+            render(template, {'ctx': ctx_factory(model, 'rsc', req)}, request=req)
+            n += 1
+    env['closer']()
+    return n
+
+
+def write_snapshots(args, version):
+    """
+    Write the static JSON snapshots of entries and sentences - if a directory is configured
+    as `cdk.snapshot_dir` or via environment variable `CDK_SNAPSHOT_DIR`.
+    """
+    directory = get_option(args, 'snapshot_dir')
+    if not directory:
+        return {}
+    return snapshots.write(directory, version)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    parser = argparse.ArgumentParser(description=update.__doc__.strip().split('\n')[0])
+    parser.add_argument(
+        'config_uri', action=BootstrappedAppConfig, help='ini file providing app config')
+    args = parser.parse_args()
+    with SessionContext(args.settings):
+        with transaction.manager:
+            update(args)
+            prime_cache(args)
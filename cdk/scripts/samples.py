@@ -0,0 +1,26 @@
+# coding: utf8
+"""
+Sample rows of the CSV tables of nouns and verbs - used as fixtures by the test suite and
+to generate the synthetic corpus of `cdk.scripts.benchmark`.
+"""
+from __future__ import unicode_literals
+
+NOUNS = [
+    ['lemma', 'POS', 'pl', 'rus', 'ger', 'eng', 'examples'],
+    ['aˀt', 'n', 'adεŋ', 'кость', 'Knochen', 'bone',
+     "pak. qūsʲ aˀt  одна кость, kel. aˀt qusʲam  кость одна, "
+     "leb. aˀt ilʲ  кость грызи  bū tɨˀn  он ест (КФТ: 29)"],
+    ['aˀt', 'n', 'adεŋ', '2. рост', 'Wuchs', 'height',
+     "аl. buda aˀt  его рост, pak. báàt bǝ̄nʲ qà aˀt  старик небольшого роста"],
+    ['anát-qodes (nket., sket. anát-qɔrεs, cket. anát-qɔdεs)', 'n', '', 'ум', 'Verstand',
+     'mind', "kur. āb anun  мой ум, sul. anunan kʌjga  бестолковая голова"],
+    ['boltaq1 (nket.)', 'adv', '', 'кость', 'Knochen', 'bone',
+     "pak. qūsʲ aˀt  одна кость, kel. hɨlʲ  вон (СНСС72: 83)"],
+    ['ambel <rus.>', 'adj', '', 'хороший', 'gut', 'good', "ambel  хороший"],
+]
+VERBS = [
+    ['ba', 'v1', 'caus mom', 'заходить', 'untergehen', 'set',
+     "kel. qīp thitlut iʁɔt dahɔ́lɛtɛsʲ  месяц сел, солнце встало  "
+     "sket. qīp thitsut [thitsuʁut]  луна заходит (WER1: 317), "
+     "cket., nket. thɛtsɔʁɔt  он заходит (WER1: 317)"],
+]
@@ -0,0 +1,128 @@
+# coding: utf8
+"""
+Opt-in instrumentation of the import.
+
+A `Timer` accumulates wall-clock time and item counts per stage of the import. Disabled
+timers - the default - do nothing, so the instrumentation can stay in place.
+"""
+from __future__ import unicode_literals, print_function, division
+import io
+import json
+import time
+import cProfile
+import contextlib
+from collections import OrderedDict
+
+
+@contextlib.contextmanager
+def _noop():
+    yield
+
+
+class Clock(object):
+    """
+    Times consecutive stages of sequential code, see `Timer.clock`.
+    """
+    def __init__(self, timer):
+        self.timer = timer
+        self.start = time.perf_counter()
+
+    def lap(self, stage, n=1):
+        """
+        Record the time since the last lap as `n` items of `stage`.
+        """
+        now = time.perf_counter()
+        self.timer.add(stage, n, now - self.start)
+        self.start = now
+
+
+class Timer(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stats = OrderedDict()
+
+    def __call__(self, stage, n=1):
+        """
+        :return: Context manager timing the execution of its block as `n` items of `stage`.
+        """
+        return self._timed(stage, n) if self.enabled else _noop()
+
+    @contextlib.contextmanager
+    def _timed(self, stage, n):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, n, time.perf_counter() - start)
+
+    def clock(self):
+        return Clock(self)
+
+    def add(self, stage, n=0, seconds=0.0):
+        if self.enabled:
+            stats = self.stats.setdefault(stage, [0, 0.0])
+            stats[0] += n
+            stats[1] += seconds
+
+    def update(self, stats):
+        """
+        Merge the stats of another timer - e.g. one used in a worker process.
+        """
+        for stage, (n, seconds) in stats.items():
+            self.add(stage, n, seconds)
+
+    def iterate(self, stage, iterable):
+        """
+        Time the iteration over `iterable`, counting the items.
+        """
+        if not self.enabled:
+            for item in iterable:
+                yield item
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, 0, time.perf_counter() - start)
+                return
+            self.add(stage, 1, time.perf_counter() - start)
+            yield item
+
+    def report(self):
+        """
+        :return: The stats formatted as text table.
+        """
+        lines = ['{0:<24} {1:>10} {2:>10} {3:>12}'.format('stage', 'count', 'seconds', 'µs/item')]
+        for stage, (n, seconds) in self.stats.items():
+            lines.append('{0:<24} {1:>10} {2:>10.3f} {3:>12}'.format(
+                stage, n, seconds, '{0:.1f}'.format(seconds * 1e6 / n) if n else ''))
+        return '\n'.join(lines)
+
+    def write(self, fname):
+        with io.open(fname, 'w', encoding='utf8') as fp:
+            json.dump(
+                OrderedDict(
+                    (stage, dict(count=n, seconds=seconds))
+                    for stage, (n, seconds) in self.stats.items()),
+                fp,
+                indent=2)
+
+
+@contextlib.contextmanager
+def profiled(fname=None):
+    """
+    Profile the execution of the block with cProfile, writing the stats to `fname` - to be
+    inspected with `pstats` or tools like snakeviz. Without `fname` nothing is done.
+    """
+    if not fname:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(fname)
@@ -1,14 +1,25 @@
 # coding: utf8
 from __future__ import unicode_literals, print_function, division
 import re
-from collections import defaultdict
-from itertools import groupby, chain, combinations
 import io
-
+import json
+import pickle
+import sqlite3
+import hashlib
+import functools
+from collections import defaultdict, Counter, deque
+from itertools import groupby, chain, islice
+
+from sqlalchemy import select, not_, exists
+from zope.sqlalchemy import mark_changed
+from clld.cliutil import Data
 from clld.db.meta import DBSession
 from clld.db.models import common
 
 from cdk import models
+from cdk.util import normalize
+from cdk.scripts.writer import OrmWriter, Row
+from cdk.scripts.timing import Timer
 
 
 SOURCE_MAP = {
@@ -155,6 +166,7 @@ def string2regex(s):
 
 DIS_ROMAN_PATTERN = re.compile('\s+(?P<marker>I+)\s*$')
 DIS_ARABIC_PATTERN = re.compile('(?P<marker>[1-9]+)$')
+MEANING_NUMBER_PATTERN = re.compile('(?P<marker>[0-9]+)\.\s+')
 DONOR_PATTERN = re.compile('\s*<(?P<name>%s)\.\s*>\s*' % '|'.join(DONORS.keys()))
 
 # dialectal variants in braces:
@@ -168,14 +180,259 @@ LOC_PATTERN = re.compile('(?:(\]|\?|!|,|\s\s)\s*|^)(%s)\.,?\s+' %
                          '|'.join(string2regex(s)
                                   for s in chain(LOCATIONS.keys(), DIALECTS.keys(), ['ket'])))
 
+
+def marker_trie(markers):
+    """
+    :return: Prefix trie of the reversed markers, as nested `dict`s, with the markers \
+    stored under key `None` of their final node.
+    """
+    root = {}
+    for marker in markers:
+        node = root
+        for c in reversed(marker):
+            node = node.setdefault(c, {})
+        node[None] = marker
+    return root
+
+
+LOC_TRIE = marker_trie(chain(LOCATIONS.keys(), DIALECTS.keys(), ['ket']))
+LOC_END_PATTERN = re.compile('\.,?\s+')
+
+
+def split_locations(s):
+    """
+    Split a string at location markers.
+
+    The result is the same as for `LOC_PATTERN.split(s)`, i.e. a list
+    `[chunk, separator, marker, chunk, separator, marker, ..., chunk]`, but rather than
+    trying to match the regex at each position, we only look at the full stops in `s`
+    and look up the markers ending there in `LOC_TRIE`.
+    """
+    res, pos = [], 0
+    for m in LOC_END_PATTERN.finditer(s):
+        node, i = LOC_TRIE, m.start() - 1
+        while i >= pos and s[i] in node:
+            node, i = node[s[i]], i - 1
+            if None not in node:
+                continue
+            start = j = i + 1
+            if start == 0:
+                res.extend(['', None, node[None]])
+                pos = m.end()
+                break
+            # The marker must be preceded by a separator, i.e. one of "]?!," or two
+            # whitespace characters, and optional whitespace:
+            while j > pos and s[j - 1].isspace():
+                j -= 1
+            if j > pos and s[j - 1] in ']?!,':
+                res.extend([s[pos:j - 1], s[j - 1], node[None]])
+                pos = m.end()
+                break
+            if start - j >= 2:
+                res.extend([s[pos:j], s[j:j + 2], node[None]])
+                pos = m.end()
+                break
+    res.append(s[pos:])
+    return res
+
+
 SOURCE_PATTERN = re.compile('\s*\((?P<src>[^:\s\(\)]+):\s*(?P<pages>[^\)]+)(?:\)\s*$|\),?\s*)')
 SOURCE_MARKER = re.compile('\s*\((?P<src>[^:\s\(\)]+):\s*(?P<pages>[^\)]+)\),?\s*')
 
-MEANING_ID = 0
-ENTRY_ID = 0
-EXAMPLE_ID = 0
-SOURCE_ID = 0
-PROBLEMS = []
+
+class ProblemLog(object):
+    """
+    Collects the problems the parsers encounter.
+
+    Problems are counted by parser stage and category and - if a file name is given -
+    written to a JSONL file, one object per problem, when `flush` is called.
+    """
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.row = None
+        self.counts = Counter()
+        self.items = []
+        self._mode = 'w'
+
+    def __call__(self, stage, category, s):
+        self.add(dict(row=self.row, stage=stage, category=category, string=s))
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, problem):
+        self.counts[(problem['stage'], problem['category'])] += 1
+        self.items.append(problem)
+        if self.fname and len(self.items) >= 10000:
+            # Don't keep an unbounded number of problems in memory.
+            self.flush()
+
+    def flush(self):
+        if self.fname and self.items:
+            with io.open(self.fname, self._mode, encoding='utf8') as fp:
+                for problem in self.items:
+                    fp.write(json.dumps(problem, ensure_ascii=False) + '\n')
+            self._mode = 'a'
+        self.items = []
+
+
+def parser_version():
+    """
+    A fingerprint of the parsing code - i.e. of this module - and of the mapping tables
+    it relies on, used to invalidate cached parse results.
+    """
+    md5 = hashlib.md5()
+    with io.open(__file__, 'rb') as fp:
+        md5.update(fp.read())
+    md5.update(repr([
+        sorted(table.items(), key=repr)
+        for table in [SOURCE_MAP, POS, ASPECTS, DIALECTS, DONORS, LOCATIONS]]).encode('utf8'))
+    return md5.hexdigest()
+
+
+class ParseCache(object):
+    """
+    Persistent cache of parse results, stored in a SQLite database.
+
+    Results are keyed by a hash of the parser version and the input string, and are
+    stored together with the problems the parser reported for the input - which are
+    reported again whenever a cached result is used. Results computed with another
+    version of the parser are deleted when the cache is opened.
+
+    A pickled cache is re-opened read-only - so it can be used in worker processes, which
+    pass new results back to the main process (see `parse_group` and `load`).
+    """
+    def __init__(self, fname, readonly=False, version=None):
+        self.fname = fname
+        self.readonly = readonly
+        self.version = version or parser_version()
+        self.new = {}
+        self.added = 0
+        if readonly:
+            self.db = sqlite3.connect('file:{0}?mode=ro'.format(fname), uri=True)
+        else:
+            self.db = sqlite3.connect(fname)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS result '
+                '(key TEXT PRIMARY KEY, version TEXT, value BLOB)')
+            self.db.execute('DELETE FROM result WHERE version != ?', (self.version,))
+            self.db.commit()
+
+    def __reduce__(self):
+        return self.__class__, (self.fname, True, self.version)
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM result').fetchone()[0]
+
+    def __call__(self, func, s, problems):
+        """
+        :return: The (possibly cached) result of `func(s, problems)`.
+        """
+        key = hashlib.md5(
+            '{0} {1} {2}'.format(self.version, func.__name__, s).encode('utf8')).hexdigest()
+        value = self.new.get(key)
+        if value is None:
+            row = self.db.execute('SELECT value FROM result WHERE key = ?', (key,)).fetchone()
+            if row:
+                value = pickle.loads(row[0])
+            else:
+                log = ProblemLog()
+                value = self.new[key] = dict(
+                    result=func(s, log),
+                    problems=[(p['stage'], p['category'], p['string']) for p in log.items])
+        for stage, category, string in value['problems']:
+            problems(stage, category, string)
+        return value['result']
+
+    def pop_new(self):
+        """
+        :return: `dict` of the results computed since the last call.
+        """
+        new, self.new = self.new, {}
+        return new
+
+    def add(self, results):
+        assert not self.readonly
+        # Workers parsing in parallel may compute the same result for different groups - so
+        # we only count the results which are actually inserted:
+        n = self.db.executemany(
+            'INSERT OR IGNORE INTO result (key, version, value) VALUES (?, ?, ?)',
+            [(k, self.version, pickle.dumps(v, protocol=2)) for k, v in results.items()]
+        ).rowcount
+        self.added += n
+        if n and self.added % 1000 < n:
+            # Commit regularly, to make results available to worker processes.
+            self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class ImportContext(object):
+    """
+    The state of an import: ID allocation, the objects created so far - keyed for
+    deduplication - the writer persisting new objects and the problem log.
+
+    :param data: `clld.cliutil.Data` instance.
+    :param writer: `cdk.scripts.writer.OrmWriter` (the default) or \
+    `cdk.scripts.writer.BulkWriter` instance.
+    :param problems: `ProblemLog` instance.
+    :param cache: Optional `ParseCache` instance.
+    :param timer: Optional `cdk.scripts.timing.Timer` instance.
+    """
+    def __init__(self, data=None, writer=None, problems=None, cache=None, timer=None):
+        self.data = Data() if data is None else data
+        self.writer = writer or OrmWriter(self.data)
+        self.problems = ProblemLog() if problems is None else problems
+        self.cache = cache
+        self.timer = timer or Timer(enabled=False)
+        self.ids = Counter()
+
+    @classmethod
+    def from_db(cls, data=None, writer=None, problems=None, cache=None, timer=None):
+        """
+        Create a context to continue an import into an existing database, i.e. with ID
+        allocation continuing after the existing IDs and deduplication maps for meanings
+        and examples filled from the database.
+
+        :raises ValueError: If the database lacks the bookkeeping of incremental imports - \
+        i.e. was created by an import predating them. Every headword group would be loaded \
+        again as new group, so such a database must be rebuilt with a full import.
+        """
+        ctx = cls(data=data, writer=writer, problems=problems, cache=cache, timer=timer)
+        if DBSession.query(models.Entry.pk).first() and (
+                not DBSession.query(models.HeadwordGroup.pk).first() or
+                any('loc' not in (jsondata or {})
+                    for jsondata, in DBSession.query(common.Sentence.jsondata))):
+            raise ValueError(
+                'The database has no bookkeeping of headword groups and example locations - '
+                'it must be rebuilt with a full import before it can be updated.')
+        for model in [models.Entry, models.Meaning, common.Sentence]:
+            ctx.ids[model.__name__] = max(
+                [int(id_) for id_, in DBSession.query(model.id) if id_.isdigit()] or [0])
+        for pk, russian, german, english in DBSession.query(
+                models.Meaning.pk,
+                models.Meaning.russian,
+                models.Meaning.german,
+                models.Meaning.english):
+            ctx.data['Meaning'][(russian, german, english)] = Row(pk=pk)
+        for pk, name, description, jsondata in DBSession.query(
+                common.Sentence.pk,
+                common.Sentence.name,
+                common.Sentence.description,
+                common.Sentence.jsondata):
+            ctx.data['Sentence'][(name, description, jsondata.get('loc'))] = Row(pk=pk)
+        return ctx
+
+    def next_id(self, model):
+        """
+        :param model: Name of the model class, e.g. "Entry".
+        :return: The next free id for objects of the model class.
+        """
+        self.ids[model] += 1
+        return str(self.ids[model])
 
 
 def in_brackets(s):
@@ -215,12 +472,15 @@ def yield_variants(s):
 
 
 class Headword(object):
-    def __init__(self, headword):
+    def __init__(self, headword, problems=None):
+        problems = ProblemLog() if problems is None else problems
         self.donor, self.dialects, self.variants = None, [], defaultdict(list)
         match = DONOR_PATTERN.search(headword)
         if match:
             self.donor = match.group('name')
             headword = headword[:match.start()] + headword[match.end():]
+        elif '<' in headword:
+            problems('Headword', 'unknown donor', headword)
         match = VARIANTS_PATTERN.search(headword)
         if match:
             # get matching closing bracket!
@@ -254,11 +514,12 @@ class Headword(object):
         self.form = headword
 
 
-def yield_examples(s):
+def yield_examples(s, problems=None):
+    problems = ProblemLog() if problems is None else problems
     #
     # FIXME: we must retain the first char of LOC_PATTERN if it is !, ?, ]
     #
-    chunks = [(ss or '').strip() for ss in LOC_PATTERN.split(s)]
+    chunks = [(ss or '').strip() for ss in split_locations(s)]
 
     for i in range(1, len(chunks), 3):
         try:
@@ -269,7 +530,7 @@ def yield_examples(s):
             pass
 
     if chunks[0]:
-        for res in yield_cited_examples(chunks[0]):
+        for res in yield_cited_examples(chunks[0], problems=problems):
             yield res
 
     local_examples = [chunks[i:i + 3] for i in range(1, len(chunks), 3)]
@@ -277,7 +538,7 @@ def yield_examples(s):
     for i, (sep, dialect, chunk) in enumerate(local_examples):
         parts = chunk.split('  ', 2)
         if len(parts) == 1:
-            PROBLEMS.append(s)
+            problems('yield_examples', 'missing translation', s)
             parts.append('')
 
         src_match = SOURCE_MARKER.search(parts[1])
@@ -301,11 +562,12 @@ def yield_examples(s):
             yield d, text, rus, src, pages
         yield dialect, text, rus, src, pages
         if len(parts) > 2:
-            for res in yield_cited_examples('  '.join(parts[2:])):
+            for res in yield_cited_examples('  '.join(parts[2:]), problems=problems):
                 yield res
 
 
-def yield_cited_examples(s):
+def yield_cited_examples(s, problems=None):
+    problems = ProblemLog() if problems is None else problems
     done = False
     chunks = [ss.strip() for ss in SOURCE_PATTERN.split(s)]
     if len(chunks) == 1:
@@ -320,7 +582,7 @@ def yield_cited_examples(s):
         try:
             assert rem == 1 and not chunks[-1]
         except AssertionError:
-            PROBLEMS.append(s)
+            problems('yield_cited_examples', 'text after last source', s)
             yield None, chunks[-1], None, None, None
 
         for chunk, src, pages in [chunks[i:i + 3] for i in range(0, count * 3, 3)]:
@@ -331,128 +593,413 @@ def yield_cited_examples(s):
                 assert len(parts) == 2
                 yield None, parts[0], parts[1], src, pages
             except AssertionError:
-                PROBLEMS.append(s)
+                problems('yield_cited_examples', 'unpaired text and translation', s)
                 yield None, '  '.join(parts), None, src, pages
 
 
-def get_entry(**kw):
-    global ENTRY_ID
-    ENTRY_ID += 1
+def get_entry(ctx, id=None, **kw):
     kw['pos'] = POS[kw['pos']] if kw['pos'] else None
     kw['donor'] = DONORS[kw['donor']] if kw['donor'] else None
-    return models.Entry(id=str(ENTRY_ID), **kw)
-
+    kw['normalized'] = normalize(kw['name'])
+    return ctx.writer.add_entry(id=id or ctx.next_id('Entry'), **kw)
+
+
+def iter_chunks(fp, sep, size=2 ** 16):
+    """
+    Streaming version of `fp.read().split(sep)`.
+    """
+    rem = ''
+    for block in iter(lambda: fp.read(size), ''):
+        chunks = (rem + block).split(sep)
+        rem = chunks.pop()
+        for chunk in chunks:
+            yield chunk
+    yield rem
+
+
+def _map(func, items):
+    return [func(item) for item in items]
+
+
+def bounded_map(executor, func, iterable, chunksize=100, prefetch=8):
+    """
+    Like `executor.map`, but consuming `iterable` lazily: Only up to `prefetch` chunks of
+    `chunksize` items are submitted ahead of the consumer of the results - thus memory use
+    is bounded, no matter how long `iterable` is.
+    """
+    iterable, futures = iter(iterable), deque()
+    while True:
+        while len(futures) < prefetch:
+            chunk = list(islice(iterable, chunksize))
+            if not chunk:
+                break
+            futures.append(executor.submit(_map, func, chunk))
+        if not futures:
+            return
+        for res in futures.popleft().result():
+            yield res
 
-def load(data, reader, ket, contrib, verbs=True):
-    dis_arabic_pattern = re.compile('(?P<marker>[0-9]+)\.\s+')
-    global MEANING_ID
-    global EXAMPLE_ID
-    global SOURCE_ID
 
-    for headword, meanings in groupby(reader, lambda r: (r[0], r[1], r[2])):
-        meanings = list(meanings)
-        if not meanings:
-            continue
+def iter_groups(reader):
+    """
+    Group the rows of a CSV table by (headword, pos, aspect or plural).
 
-        headword, pos, aspect_or_plural = headword
+    :return: Generator of `dict`s with keys "row" (number of the first row), "rows", \
+    "key" (identifying the group within the table) and "hash" (of the rows).
+    """
+    rowno, keys = 0, Counter()
+    for (headword, pos, _), rows in groupby(reader, lambda r: (r[0], r[1], r[2])):
+        rows = list(rows)
+        first_row, rowno = rowno + 1, rowno + len(rows)
         pos = pos.strip()
         if (not pos and not headword) or (headword == 'lemma' and pos == 'POS'):
             continue
-        assert (not pos) or (pos in POS), 'pos: %s, %s' % pos
-
-        headword = Headword(headword)
-        entries = []
-        kw = dict(
-            donor=headword.donor,
-            disambiguation=headword.disambiguation,
-            pos=pos,
-            variant=False,
-            aspect=aspect_or_plural if verbs else None,
-            plural=None if verbs else aspect_or_plural,)
-
-        if headword.dialects:
-            for dialect in headword.dialects:
-                entries.append(get_entry(
-                    name=headword.form,
-                    language=data['Language'][dialect],
-                    **kw))
-        else:
-            entries.append(get_entry(name=headword.form, language=ket, **kw))
-
-        kw['variant'] = True
-        for dialect, forms in headword.variants.items():
-            for form in forms:
-                entries.append(get_entry(
-                    name=form,
-                    language=ket if dialect is None else data['Language'][dialect],
-                    **kw))
-
-        DBSession.flush()
-        for e1, e2 in combinations(entries, 2):
-            DBSession.add(models.Variants(entry1=e1, entry2=e2))
-
-        for j, row in enumerate(meanings):
-            headword, pos, aspect, russian, german, english, description = row
-            match = dis_arabic_pattern.match(russian)
-            if match:
-                russian = russian[match.end():].strip()
-            meaning = data['Meaning'].get((russian, german, english))
-            if not meaning:
-                MEANING_ID += 1
-                meaning = data.add(
-                    models.Meaning,
-                    (russian, german, english),
-                    id=str(MEANING_ID),
-                    name=english,
-                    russian=russian,
-                    german=german,
-                    english=english)
-
-            for entry in entries:
-                counterpart = common.UnitValue(
-                    id='%s-%s' % (entry.id, j + 1),
-                    name=entry.name,
-                    description='%s / %s / %s' % (english, russian, german),
-                    contribution=contrib,
-                    unit=entry,
-                    unitparameter=meaning)
-
-                for k, (loc, text, rus, source, pages) in enumerate(yield_examples(description.strip())):
-                    example = data['Sentence'].get((text, rus, loc))
-                    if example is None:
-                        EXAMPLE_ID += 1
-                        example = data.add(
-                            common.Sentence,
-                            (text, rus, loc),
-                            id='%s' % EXAMPLE_ID,
-                            language=data['Language'].get(loc, ket),
-                            name=text,
-                            description=rus)
-                        if source:
-                            if (source, pages) in SOURCE_MAP:
-                                print(source, pages)
-                                source, pages = SOURCE_MAP[(source, pages)]
-                            else:
-                                source = SOURCE_MAP.get(source, source)
-                            src = data['Source'].get(source)
-                            if not src:
-                                print(source)
-                                raise ValueError(source)
-                                SOURCE_ID += 1
-                                src = data.add(
-                                    common.Source, source,
-                                    id=str(SOURCE_ID),
-                                    name=source,
-                                    description=None)
-                            DBSession.add(common.SentenceReference(
-                                sentence=example, source=src, description=pages))
-                    models.CounterpartExample(
-                        location=LOCATIONS.get(loc, DIALECTS.get(loc)),
-                        counterpart=counterpart,
-                        sentence=example)
+        key = json.dumps(rows[0][:3], ensure_ascii=False)
+        keys[key] += 1
+        if keys[key] > 1:
+            # The same headword may appear in non-adjacent rows.
+            key = '%s %s' % (key, keys[key])
+        yield dict(
+            row=first_row,
+            rows=rows,
+            key=key,
+            hash=hashlib.md5(json.dumps(rows).encode('utf8')).hexdigest())
+
+
+def parse_headword(s, problems):
+    headword = Headword(s, problems=problems)
+    return dict(
+        form=headword.form,
+        donor=headword.donor,
+        disambiguation=headword.disambiguation,
+        dialects=headword.dialects,
+        variants=list(headword.variants.items()))
+
+
+def parse_examples(s, problems):
+    return list(yield_examples(s.strip(), problems=problems))
+
+
+def parse_group(group, cache=None, timing=False):
+    """
+    Parse the rows for one headword.
+
+    Parsing does not touch the database, so it can be run in worker processes.
+
+    :param group: `dict` as yielded by `iter_groups`.
+    :param cache: Optional `ParseCache` instance.
+    :param timing: Flag signaling whether to time the parsing stages.
+    :return: `dict` of plain data.
+    """
+    first_row, rows = group['row'], group['rows']
+    problems, timer = ProblemLog(), Timer(enabled=timing)
+    parse = (lambda func, s, problems: func(s, problems)) if cache is None else cache
+    headword, pos, aspect_or_plural = rows[0][:3]
+    pos = pos.strip()
+    assert (not pos) or (pos in POS), 'pos: %s, %s' % pos
+
+    problems.row = first_row
+    res = dict(row=first_row, key=group['key'], hash=group['hash'])
+    with timer('parse headwords'):
+        res.update(parse(parse_headword, headword, problems))
+    meanings = []
+    for j, row in enumerate(rows):
+        russian, german, english, description = row[3:]
+        match = MEANING_NUMBER_PATTERN.match(russian)
+        if match:
+            russian = russian[match.end():].strip()
+        problems.row = first_row + j
+        with timer('parse examples'):
+            examples = parse(parse_examples, description, problems)
+        meanings.append(dict(russian=russian, german=german, english=english, examples=examples))
+
+    res.update(
+        pos=pos,
+        aspect_or_plural=aspect_or_plural,
+        meanings=meanings,
+        problems=problems.items,
+        cache={} if cache is None else cache.pop_new(),
+        timing=timer.stats)
+    return res
+
+
+def parse_groups(ctx, groups, executor=None):
+    """
+    Parse headword groups - in parallel, if an `executor` is passed.
+
+    :return: Generator of the parsed groups, in input order.
+    """
+    parse = functools.partial(parse_group, cache=ctx.cache, timing=ctx.timer.enabled)
+    if executor:
+        groups = bounded_map(executor, parse, groups)
+    else:
+        groups = map(parse, groups)
+
+    for group in groups:
+        for problem in group['problems']:
+            ctx.problems.add(problem)
+        if ctx.cache is not None:
+            ctx.cache.add(group['cache'])
+        ctx.timer.update(group['timing'])
+        yield group
+
+
+def load(ctx, reader, ket, contrib, verbs=True, executor=None):
+    """
+    Load the dictionary data from the rows of one of the CSV tables.
+
+    The data is processed in two stages: Each headword group is parsed into plain data by
+    `parse_group` - possibly in parallel, if an `executor` is passed - and then loaded
+    into the database, in input order, by `load_group`. The rows are streamed through this
+    pipeline, so - with a `BulkWriter` flushing its chunks - only a bounded number of
+    groups is held in memory at any time. Parse results are looked up in -
+    and added to - `ctx.cache`, if the context has one.
+
+    :param ctx: `ImportContext` instance.
+    :param executor: `concurrent.futures.Executor` instance used for parsing.
+    """
+    reader = ctx.timer.iterate('read CSV', reader)
+    for group in parse_groups(ctx, iter_groups(reader), executor=executor):
+        load_group(ctx, group, ket, contrib, verbs=verbs)
+
+
+def update_groups(ctx, reader, ket, contrib, verbs=True, executor=None):
+    """
+    Incrementally update the data loaded from one of the CSV tables.
+
+    Headword groups are compared with the hashes recorded by the last import. Only groups
+    which changed are deleted and loaded again - re-using the entry IDs of the previous
+    import; groups which have been removed from the table are deleted.
+
+    :param ctx: `ImportContext` instance as returned by `ImportContext.from_db`.
+    :return: `Counter` of groups by status "unchanged", "changed", "new" and "removed".
+    """
+    stats = Counter()
+    previous = {
+        g.key: g for g in
+        DBSession.query(models.HeadwordGroup).filter_by(csv='verbs' if verbs else 'nouns')}
+    reuse = {}
+
+    def changed_groups():
+        for group in iter_groups(ctx.timer.iterate('read CSV', reader)):
+            prev = previous.pop(group['key'], None)
+            if prev and prev.hash == group['hash']:
+                stats['unchanged'] += 1
+                continue
+            if prev:
+                stats['changed'] += 1
+                reuse[group['key']] = prev.jsondata['entries']
+                delete_groups([prev])
+            else:
+                stats['new'] += 1
+            yield group
+
+    for group in parse_groups(ctx, changed_groups(), executor=executor):
+        load_group(ctx, group, ket, contrib, verbs=verbs, entry_ids=reuse.get(group['key']))
+
+    stats['removed'] = len(previous)
+    delete_groups(previous.values())
+    return stats
+
+
+def delete_groups(groups):
+    """
+    Delete the entries created from the given headword groups - with their counterparts,
+    variant groups and examples - and the groups themselves.
+
+    Meanings and example sentences may be shared between groups; those which are no longer
+    referenced can be removed with `delete_orphans`.
+    """
+    groups = list(groups)
+    if not groups:
+        return
+    ids = [id_ for g in groups for id_ in g.jsondata['entries']]
+    pks = select([common.Unit.__table__.c.pk]).where(common.Unit.__table__.c.id.in_(ids))
+    uv = common.UnitValue.__table__
+    # The variant groups must be looked up before their entries are deleted:
+    vgs = [pk for pk, in DBSession.execute(
+        select([models.Entry.__table__.c.variantgroup_pk]).distinct()
+        .where(models.Entry.__table__.c.pk.in_(pks))
+        .where(models.Entry.__table__.c.variantgroup_pk.isnot(None)))]
+    for table, cond in [
+        (models.CounterpartExample.__table__,
+         models.CounterpartExample.__table__.c.unitvalue_pk.in_(
+             select([uv.c.pk]).where(uv.c.unit_pk.in_(pks)))),
+        (models.CounterpartSearch.__table__,
+         models.CounterpartSearch.__table__.c.unit_pk.in_(pks)),
+        (uv, uv.c.unit_pk.in_(pks)),
+        (models.Entry.__table__, models.Entry.__table__.c.pk.in_(pks)),
+        (common.Unit.__table__, common.Unit.__table__.c.id.in_(ids)),
+        (models.VariantGroup.__table__, models.VariantGroup.__table__.c.pk.in_(vgs)),
+        (models.HeadwordGroup.__table__,
+         models.HeadwordGroup.__table__.c.pk.in_([g.pk for g in groups])),
+    ]:
+        DBSession.execute(table.delete().where(cond))
+    mark_changed(DBSession())
+
+
+def delete_orphans():
+    """
+    Delete meanings and example sentences which are not referenced anymore.
+    """
+    ce, uv = models.CounterpartExample.__table__, common.UnitValue.__table__
+    sentences = select([common.Sentence.__table__.c.pk]).where(not_(exists().where(
+        ce.c.sentence_pk == common.Sentence.__table__.c.pk)))
+    meanings = select([common.UnitParameter.__table__.c.pk]).where(not_(exists().where(
+        uv.c.unitparameter_pk == common.UnitParameter.__table__.c.pk)))
+    res = Counter()
+    for table, cond in [
+        (common.SentenceReference.__table__,
+         common.SentenceReference.__table__.c.sentence_pk.in_(sentences)),
+        (common.Sentence.__table__, common.Sentence.__table__.c.pk.in_(sentences)),
+        (models.Meaning.__table__, models.Meaning.__table__.c.pk.in_(meanings)),
+        (common.UnitParameter.__table__, common.UnitParameter.__table__.c.pk.in_(meanings)),
+    ]:
+        res[table.name] = DBSession.execute(table.delete().where(cond)).rowcount
+    mark_changed(DBSession())
+    return res
+
+
+def fill_counterpart_search():
+    """
+    (Re-)fill the denormalized search table for counterparts.
+
+    :return: Number of rows inserted.
+    """
+    cs = models.CounterpartSearch.__table__
+    uv, unit, entry, meaning = [
+        m.__table__ for m in [common.UnitValue, common.Unit, models.Entry, models.Meaning]]
+    DBSession.execute(cs.delete())
+    mark_changed(DBSession())
+    cols = [
+        uv.c.pk,
+        uv.c.unit_pk,
+        uv.c.unitparameter_pk,
+        uv.c.contribution_pk,
+        unit.c.language_pk,
+        unit.c.name,
+        entry.c.normalized,
+        entry.c.variant,
+        meaning.c.english,
+        meaning.c.russian,
+        entry.c.pos,
+        entry.c.aspect,
+        entry.c.plural,
+        entry.c.donor,
+    ]
+    query = select(cols)\
+        .select_from(
+            uv.join(unit).join(entry).join(meaning, meaning.c.pk == uv.c.unitparameter_pk))\
+        .where(uv.c.active == True)
+    return DBSession.execute(cs.insert().from_select(
+        [c.name for c in cols[:5]] + ['form'] + [c.name for c in cols[6:]], query)).rowcount
+
+
+def load_group(ctx, group, ket, contrib, verbs=True, entry_ids=None):
+    """
+    Load the parsed data for one headword group.
+
+    :param entry_ids: IDs to be re-used for the entries, e.g. from a previous import.
+    """
+    data, writer, clock = ctx.data, ctx.writer, ctx.timer.clock()
+    entry_ids = list(entry_ids or [])
+    entries = []
+    kw = dict(
+        donor=group['donor'],
+        disambiguation=group['disambiguation'],
+        pos=group['pos'],
+        variant=False,
+        aspect=group['aspect_or_plural'] if verbs else None,
+        plural=None if verbs else group['aspect_or_plural'],)
+
+    # All entries created from a headword are variants of each other:
+    if max(len(group['dialects']), 1) + sum(len(f) for _, f in group['variants']) > 1:
+        kw['variantgroup'] = writer.add_variantgroup()
+    clock.lap('create variant groups', int('variantgroup' in kw))
+
+    if group['dialects']:
+        for dialect in group['dialects']:
+            entries.append(get_entry(
+                ctx,
+                id=entry_ids.pop(0) if entry_ids else None,
+                name=group['form'],
+                language=data['Language'][dialect],
+                **kw))
+    else:
+        entries.append(get_entry(
+            ctx,
+            id=entry_ids.pop(0) if entry_ids else None,
+            name=group['form'],
+            language=ket,
+            **kw))
+
+    kw['variant'] = True
+    for dialect, forms in group['variants']:
+        for form in forms:
+            entries.append(get_entry(
+                ctx,
+                id=entry_ids.pop(0) if entry_ids else None,
+                name=form,
+                language=ket if dialect is None else data['Language'][dialect],
+                **kw))
+
+    clock.lap('create entries', len(entries))
+    writer.flush()
+    clock.lap('flush')
+
+    for j, m in enumerate(group['meanings']):
+        russian, german, english = m['russian'], m['german'], m['english']
+        meaning = data['Meaning'].get((russian, german, english))
+        if not meaning:
+            meaning = writer.add_meaning(
+                (russian, german, english),
+                id=ctx.next_id('Meaning'),
+                name=english,
+                russian=russian,
+                german=german,
+                english=english)
 
         for entry in entries:
-            DBSession.add(entry)
-
-        with io.open('context-problems.txt', 'w', encoding='utf8') as fp:
-            fp.write('\n\n'.join(PROBLEMS))
+            counterpart = writer.add_unitvalue(
+                id='%s-%s' % (entry.id, j + 1),
+                name=entry.name,
+                description='%s / %s / %s' % (english, russian, german),
+                contribution=contrib,
+                unit=entry,
+                unitparameter=meaning)
+
+            for loc, text, rus, source, pages in m['examples']:
+                example = data['Sentence'].get((text, rus, loc))
+                if example is None:
+                    example = writer.add_sentence(
+                        (text, rus, loc),
+                        id=ctx.next_id('Sentence'),
+                        language=data['Language'].get(loc, ket),
+                        name=text,
+                        description=rus,
+                        # The location is part of the key used for deduplication:
+                        jsondata=dict(loc=loc))
+                    if source:
+                        if (source, pages) in SOURCE_MAP:
+                            print(source, pages)
+                            source, pages = SOURCE_MAP[(source, pages)]
+                        else:
+                            source = SOURCE_MAP.get(source, source)
+                        src = data['Source'].get(source)
+                        if not src:
+                            print(source)
+                            raise ValueError(source)
+                            src = data.add(
+                                common.Source, source,
+                                id=ctx.next_id('Source'),
+                                name=source,
+                                description=None)
+                        writer.add_sentence_reference(example, src, pages)
+                writer.add_counterpart_example(
+                    counterpart,
+                    example,
+                    LOCATIONS.get(loc, DIALECTS.get(loc)))
+
+    writer.add_headword_group(
+        entries, csv='verbs' if verbs else 'nouns', key=group['key'], hash=group['hash'])
+    clock.lap('create meanings/examples', len(group['meanings']))
@@ -0,0 +1,185 @@
+# coding: utf8
+"""
+Backends used by `cdk.scripts.util.load` to persist the parsed dictionary data.
+
+`OrmWriter` creates ORM objects, just like a regular clld import does. `BulkWriter`
+assigns primary keys up front, collects plain rows in memory and writes them in chunks
+with executemany-style Core inserts. Both writers create rows in the same order, thus
+the resulting databases are identical - up to the `created` and `updated` timestamps.
+"""
+from __future__ import unicode_literals, print_function, division
+from collections import OrderedDict
+
+from sqlalchemy import func, inspect, text
+from zope.sqlalchemy import mark_changed
+
+from clld.db.meta import DBSession, Base
+from clld.db.models import common
+
+from cdk import models
+
+
+class OrmWriter(object):
+    def __init__(self, data):
+        self.data = data
+
+    def add_entry(self, **kw):
+        entry = models.Entry(**kw)
+        DBSession.add(entry)
+        return entry
+
+    def add_variantgroup(self):
+        group = models.VariantGroup()
+        DBSession.add(group)
+        return group
+
+    def add_meaning(self, key, **kw):
+        return self.data.add(models.Meaning, key, **kw)
+
+    def add_unitvalue(self, **kw):
+        return common.UnitValue(**kw)
+
+    def add_sentence(self, key, **kw):
+        return self.data.add(common.Sentence, key, **kw)
+
+    def add_sentence_reference(self, sentence, source, description):
+        DBSession.add(common.SentenceReference(
+            sentence=sentence, source=source, description=description))
+
+    def add_counterpart_example(self, counterpart, sentence, location):
+        models.CounterpartExample(
+            location=location, counterpart=counterpart, sentence=sentence)
+
+    def add_headword_group(self, entries, **kw):
+        DBSession.add(models.HeadwordGroup(jsondata=dict(entries=[e.id for e in entries]), **kw))
+
+    def flush(self):
+        DBSession.flush()
+
+    def close(self):
+        DBSession.flush()
+
+
+class Row(dict):
+    """
+    A row to be inserted, which also provides attribute access to its values - so it can
+    stand in for an ORM object in `load`.
+    """
+    def __getattr__(self, attr):
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+
+class BulkWriter(object):
+    """
+    Collects rows per table and inserts them in chunks of (at least) `chunksize` rows.
+
+    Primary keys are assigned by the writer, continuing the sequence of each table, in
+    the order the objects would have been created by `OrmWriter`.
+    """
+    def __init__(self, data, chunksize=5000):
+        self.data = data
+        self.chunksize = chunksize
+        self._pk = {}
+        self._rows = OrderedDict()
+        self._count = 0
+
+    def _next_pk(self, model):
+        table = inspect(model).base_mapper.local_table
+        if table not in self._pk:
+            DBSession.flush()
+            self._pk[table] = DBSession.query(func.max(table.c.pk)).scalar() or 0
+        self._pk[table] += 1
+        return self._pk[table]
+
+    @staticmethod
+    def _pk_of(obj):
+        if obj.pk is None:
+            # Objects created via the ORM - e.g. languages and sources - must have their
+            # primary keys assigned before we can refer to them.
+            DBSession.flush()
+        return obj.pk
+
+    def _add(self, model, **kw):
+        mapper = inspect(model)
+        row = Row(jsondata={}, pk=self._next_pk(model))
+        row.update(kw)
+        if mapper.polymorphic_on is not None:
+            row['polymorphic_type'] = mapper.polymorphic_identity
+        for m in reversed(list(mapper.iterate_to_root())):
+            table = m.local_table
+            self._rows.setdefault(table, []).append(
+                {c.key: row.get(c.key) for c in table.c if c.key in row or c.default is None})
+            self._count += 1
+        return row
+
+    def add_entry(self, language, variantgroup=None, **kw):
+        return self._add(
+            models.Entry,
+            language_pk=self._pk_of(language),
+            variantgroup_pk=variantgroup.pk if variantgroup else None,
+            **kw)
+
+    def add_variantgroup(self):
+        return self._add(models.VariantGroup)
+
+    def add_meaning(self, key, **kw):
+        row = self._add(models.Meaning, **kw)
+        # Only keep the primary key around for deduplication, not the full row:
+        self.data['Meaning'][key] = Row(pk=row.pk)
+        return row
+
+    def add_unitvalue(self, unit, unitparameter, contribution, **kw):
+        return self._add(
+            common.UnitValue,
+            unit_pk=self._pk_of(unit),
+            unitparameter_pk=self._pk_of(unitparameter),
+            contribution_pk=self._pk_of(contribution),
+            **kw)
+
+    def add_sentence(self, key, language, **kw):
+        row = self._add(common.Sentence, language_pk=self._pk_of(language), **kw)
+        self.data['Sentence'][key] = Row(pk=row.pk)
+        return row
+
+    def add_sentence_reference(self, sentence, source, description):
+        self._add(
+            common.SentenceReference,
+            sentence_pk=self._pk_of(sentence),
+            source_pk=self._pk_of(source),
+            description=description)
+
+    def add_counterpart_example(self, counterpart, sentence, location):
+        self._add(
+            models.CounterpartExample,
+            unitvalue_pk=self._pk_of(counterpart),
+            sentence_pk=self._pk_of(sentence),
+            location=location)
+
+    def add_headword_group(self, entries, **kw):
+        self._add(models.HeadwordGroup, jsondata=dict(entries=[e.id for e in entries]), **kw)
+
+    def flush(self):
+        if self._count >= self.chunksize:
+            self._write()
+
+    def _write(self):
+        # Insert in dependency order, to not violate foreign key constraints:
+        for table in Base.metadata.sorted_tables:
+            if self._rows.get(table):
+                DBSession.execute(table.insert(), self._rows[table])
+                # Core inserts go unnoticed by zope.sqlalchemy - without marking the session
+                # as changed, the transaction would be rolled back rather than committed:
+                mark_changed(DBSession())
+        self._rows, self._count = OrderedDict(), 0
+
+    def close(self):
+        self._write()
+        if DBSession.bind.dialect.name == 'postgresql':
+            # Since we inserted explicit primary keys, the sequences must be updated:
+            for table, pk in self._pk.items():
+                DBSession.execute(
+                    text("SELECT setval(pg_get_serial_sequence(:table, 'pk'), :pk)"),
+                    dict(table=table.name, pk=pk))
@@ -0,0 +1,239 @@
+"""
+Static JSON snapshots of entries and example sentences.
+
+The data is read-only between imports, so `prime_cache` can serialize every entry - with
+its meanings, variants and examples - and every example sentence to a compact JSON file,
+compressed with gzip and - if the `brotli` package is installed - with brotli. The files
+are sharded into subdirectories by a hash of the ID, and served by the view `snapshot`,
+e.g. `/snapshots/unit/1.json`, without a single query.
+
+The snapshots of each data version are written to a directory of their own; the symlink
+`current` is switched to a new version once it is complete.
+"""
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+from collections import OrderedDict, defaultdict
+
+from clld.db.meta import DBSession
+from clld.db.models import common
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+from cdk import models
+
+# Content codings of the snapshot files, in order of preference:
+ENCODINGS = OrderedDict([('gzip', '.gz')])
+if brotli:  # pragma: no cover
+    ENCODINGS = OrderedDict([('br', '.br'), ('gzip', '.gz')])
+CURRENT = 'current'
+# Names of the directories of data versions - as created by `cdk.util.set_data_version`:
+VERSION = re.compile('[0-9a-f]{32}$')
+
+
+def compress(encoding, data):
+    if encoding == 'br':  # pragma: no cover
+        return brotli.compress(data)
+    # Leave the timestamp out of the gzip header, so unchanged data compresses the same:
+    return gzip.compress(data, mtime=0)
+
+
+def path(directory, type_, id_, encoding='gzip'):
+    """
+    :param directory: Directory holding the snapshots of one data version - e.g. the \
+    current one, `os.path.join(snapshot_dir, CURRENT)`.
+    :return: Path of the snapshot of an object - without checking that it exists.
+    """
+    return os.path.join(
+        directory,
+        type_,
+        hashlib.md5(id_.encode('utf8')).hexdigest()[:2],
+        '{0}.json{1}'.format(id_, ENCODINGS[encoding]))
+
+
+def units(pks):
+    """
+    :return: Generator of `(id, data)` pairs for the entries with primary keys `pks`.
+    """
+    uv, ce, sr = common.UnitValue, models.CounterpartExample, common.SentenceReference
+    examples, seen = defaultdict(list), set()
+    for row in DBSession.query(
+            ce.unitvalue_pk,
+            ce.location,
+            common.Sentence.id,
+            common.Sentence.name,
+            common.Sentence.description,
+            common.Language.id,
+            common.Source.name,
+            sr.description)\
+            .join(uv, uv.pk == ce.unitvalue_pk)\
+            .join(common.Sentence, common.Sentence.pk == ce.sentence_pk)\
+            .join(common.Language, common.Language.pk == common.Sentence.language_pk)\
+            .outerjoin(sr, sr.sentence_pk == common.Sentence.pk)\
+            .outerjoin(common.Source, common.Source.pk == sr.source_pk)\
+            .filter(uv.unit_pk.in_(pks))\
+            .order_by(ce.unitvalue_pk, ce.location, ce.sentence_pk, sr.pk):
+        # Like the entry page, we only list the first reference of an example:
+        if (row[0], row[2]) not in seen:
+            seen.add((row[0], row[2]))
+            examples[row[0]].append(OrderedDict(zip(
+                ['location', 'id', 'text', 'translation', 'language', 'source', 'pages'],
+                row[1:])))
+
+    meanings = defaultdict(list)
+    for row in DBSession.query(
+            uv.pk,
+            uv.unit_pk,
+            uv.id,
+            models.Meaning.id,
+            models.Meaning.english,
+            models.Meaning.russian,
+            models.Meaning.german)\
+            .join(models.Meaning, models.Meaning.pk == uv.unitparameter_pk)\
+            .filter(uv.unit_pk.in_(pks))\
+            .order_by(uv.pk):
+        meanings[row[1]].append(OrderedDict(
+            list(zip(['id', 'meaning', 'english', 'russian', 'german'], row[2:])) +
+            [('examples', examples[row[0]])]))
+
+    entries = DBSession.query(
+        models.Entry.pk,
+        models.Entry.variantgroup_pk,
+        models.Entry.id,
+        models.Entry.name,
+        common.Language.id,
+        common.Language.name,
+        models.Entry.variant,
+        models.Entry.disambiguation,
+        models.Entry.pos,
+        models.Entry.aspect,
+        models.Entry.plural,
+        models.Entry.donor)\
+        .join(common.Language, common.Language.pk == models.Entry.language_pk)\
+        .filter(models.Entry.pk.in_(pks))\
+        .order_by(models.Entry.pk)\
+        .all()
+
+    variants = defaultdict(list)
+    for row in DBSession.query(
+            models.Entry.variantgroup_pk,
+            models.Entry.pk,
+            models.Entry.id,
+            models.Entry.name,
+            common.Language.id)\
+            .join(common.Language, common.Language.pk == models.Entry.language_pk)\
+            .filter(models.Entry.variantgroup_pk.in_(set(e[1] for e in entries if e[1])))\
+            .order_by(common.Language.name, models.Entry.pk):
+        variants[row[0]].append(row[1:])
+
+    for row in entries:
+        yield row[2], OrderedDict([
+            ('id', row[2]),
+            ('name', row[3]),
+            ('language', OrderedDict([('id', row[4]), ('name', row[5])])),
+        ] + list(zip(
+            ['variant', 'disambiguation', 'pos', 'aspect', 'plural', 'donor'], row[6:])) + [
+            ('meanings', meanings[row[0]]),
+            ('variants', [
+                OrderedDict([('id', id_), ('name', name), ('language', lang)])
+                for pk, id_, name, lang in variants[row[1]] if pk != row[0]]),
+        ])
+
+
+def sentences(pks):
+    """
+    :return: Generator of `(id, data)` pairs for the sentences with primary keys `pks`.
+    """
+    ce, sr = models.CounterpartExample, common.SentenceReference
+    locations = defaultdict(list)
+    for pk, location in DBSession.query(ce.sentence_pk, ce.location)\
+            .filter(ce.sentence_pk.in_(pks))\
+            .filter(ce.location.isnot(None))\
+            .distinct()\
+            .order_by(ce.sentence_pk, ce.location):
+        locations[pk].append(location)
+
+    references = defaultdict(list)
+    for row in DBSession.query(
+            sr.sentence_pk, common.Source.id, common.Source.name, sr.description)\
+            .join(common.Source, common.Source.pk == sr.source_pk)\
+            .filter(sr.sentence_pk.in_(pks))\
+            .order_by(sr.sentence_pk, sr.pk):
+        references[row[0]].append(OrderedDict(zip(['source', 'name', 'pages'], row[1:])))
+
+    for row in DBSession.query(
+            common.Sentence.pk,
+            common.Sentence.id,
+            common.Sentence.name,
+            common.Sentence.description,
+            common.Language.id,
+            common.Language.name)\
+            .join(common.Language, common.Language.pk == common.Sentence.language_pk)\
+            .filter(common.Sentence.pk.in_(pks))\
+            .order_by(common.Sentence.pk):
+        yield row[1], OrderedDict([
+            ('id', row[1]),
+            ('text', row[2]),
+            ('translation', row[3]),
+            ('language', OrderedDict([('id', row[4]), ('name', row[5])])),
+            ('locations', locations[row[0]]),
+            ('references', references[row[0]]),
+        ])
+
+
+# Snapshot types - named like the routes of the resources - with the model and the function
+# serializing objects:
+TYPES = OrderedDict([
+    ('unit', (models.Entry, units)),
+    ('sentence', (common.Sentence, sentences)),
+])
+
+
+def write(directory, version, chunksize=500):
+    """
+    Write the snapshots of all entries and sentences for data version `version`, and make
+    them the current ones.
+
+    :return: `OrderedDict` mapping snapshot types to the number of objects written.
+    """
+    target, res = os.path.join(directory, version), OrderedDict()
+    for type_, (model, serialize) in TYPES.items():
+        res[type_] = 0
+        pks = [pk for pk, in DBSession.query(model.pk).order_by(model.pk)]
+        for i in range(0, len(pks), chunksize):
+            # Objects are serialized in chunks, each with a fixed number of queries:
+            for id_, obj in serialize(pks[i:i + chunksize]):
+                data = json.dumps(
+                    obj, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+                for encoding in ENCODINGS:
+                    fname = path(target, type_, id_, encoding=encoding)
+                    if not os.path.exists(os.path.dirname(fname)):
+                        os.makedirs(os.path.dirname(fname))
+                    with open(fname, 'wb') as fp:
+                        fp.write(compress(encoding, data))
+                res[type_] += 1
+    switch(directory, version)
+    return res
+
+
+def switch(directory, version):
+    """
+    Point the symlink `current` to the snapshots of `version` - atomically, so requests
+    always see a complete set of snapshots - and remove the snapshots of other versions.
+    Other directories - not named like data versions - are left alone.
+    """
+    tmp = os.path.join(directory, CURRENT + '.tmp')
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(version, tmp)
+    os.replace(tmp, os.path.join(directory, CURRENT))
+    for name in os.listdir(directory):
+        if name != version and VERSION.match(name) \
+                and os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name))
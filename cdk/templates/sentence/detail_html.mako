@@ -3,6 +3,10 @@
 <%! active_menu_item = "sentences" %>
 
 <%def name="sidebar()">
+    ${u.fragment(request, 'sentence', ctx, 'sidebar', lambda: capture(sidebar_content))}
+</%def>
+
+<%def name="sidebar_content()">
     <div class="well">
         <dl>
             <dt>Variety:</dt>
@@ -31,6 +35,11 @@
     </div>
 </%def>
 
+## The rendered page only changes with the data, so its fragments are cached, see
+## cdk.util.FragmentCache:
+${u.fragment(request, 'sentence', ctx, 'content', lambda: capture(content))}
+
+<%def name="content()">
 <h2>Example ${ctx.id}</h2>
 <p>for entries</p>
 <ul class="inline">
@@ -44,4 +53,4 @@
     <i>${ctx.name}</i><br/>
     ${ctx.description}
 </blockquote>
-
+</%def>
@@ -3,6 +3,10 @@
 <%! active_menu_item = "unitvalues" %>
 
 <%def name="sidebar()">
+    ${u.fragment(request, 'unit', ctx, 'sidebar', lambda: capture(sidebar_content))}
+</%def>
+
+<%def name="sidebar_content()">
     <div class="well">
         <h4>Language</h4>
         <p>
@@ -26,6 +30,11 @@
     </div>
 </%def>
 
+## The rendered page only changes with the data, so its fragments are cached, see
+## cdk.util.FragmentCache:
+${u.fragment(request, 'unit', ctx, 'content', lambda: capture(content))}
+
+<%def name="content()">
 <h2>${'Variant' if ctx.variant else 'Headword'} ${u.form(ctx.name)} <sup>${ctx.disambiguation}</sup></h2>
 
 <p>
@@ -60,3 +69,4 @@
     </li>
     % endfor
 </ol>
+</%def>
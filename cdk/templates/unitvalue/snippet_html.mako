@@ -1,3 +1,8 @@
+## The rendered snippet only changes with the data, so it is cached, see
+## cdk.util.FragmentCache:
+${u.fragment(request, 'unitvalue', ctx, 'snippet', lambda: capture(content))}
+
+<%def name="content()">
 <dl>
 % for loc, examples in u.examples_by_location(ctx):
     <dt>${loc or 'other'}</dt>
@@ -16,4 +21,5 @@
         </ul>
     </dd>
 % endfor
-</dl>
\ No newline at end of file
+</dl>
+</%def>
@@ -0,0 +1,310 @@
+# coding: utf8
+from __future__ import unicode_literals, print_function, division
+from unittest import TestCase
+import os
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import transaction
+from pyramid import testing
+from pyramid.request import Request
+from pyramid.events import BeforeRender
+from clld.db.meta import DBSession
+from clld.db.models import common
+
+import cdk
+from cdk import CdkCtxFactoryQuery, models, util, tweens, views
+from cdk.scripts.util import fill_counterpart_search
+from cdk.scripts.writer import BulkWriter
+from cdk.tests.test_load import import_data, NOUNS
+from cdk.tests.test_datatables import count_queries, setup_data
+
+
+def entry_rows(n):
+    """
+    Rows for a headword with `n` meanings, each with examples from two locations.
+    """
+    return [
+        ['qa (nket., sket. qɔˀ)', 'n', '', 'значение {0}'.format(i), 'Bedeutung {0}'.format(i),
+         'meaning {0}'.format(i),
+         'kel. qa {0}  один {0} (КФТ: {0}), pak. qa bǝ̄nʲ {0}  два {0} (WER1: {0})'.format(i)]
+        for i in range(n)]
+
+
+def make_app(directory, nouns=NOUNS, **settings):
+    """
+    The app serving the dictionary `nouns` - from a database file, because the app connects
+    to the database itself.
+    """
+    url = 'sqlite:///' + os.path.join(directory, '{0}.sqlite'.format(len(nouns)))
+    # Discard what other tests left in the session - the data is committed below:
+    transaction.abort()
+    import_data(BulkWriter, nouns=nouns, url=url)
+    DBSession.add(common.Dataset(id='cdk', name='CDK', domain='cdk.clld.org'))
+    DBSession.flush()
+    fill_counterpart_search()
+    transaction.commit()
+    DBSession.remove()
+    settings['sqlalchemy.url'] = url
+    return cdk.main({}, **settings)
+
+
+class CtxFactoryQueryTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        DBSession.remove()
+        shutil.rmtree(self.tmp)
+
+    def get_entry(self, nouns):
+        """
+        Serve the detail page of an entry - rendered with `unit/detail_html.mako` by the app.
+        """
+        app = make_app(self.tmp, nouns)
+        path = '/units/' + DBSession.query(models.Entry.id).filter_by(name='qa').scalar()
+        with count_queries() as queries:
+            res = Request.blank(path).get_response(app)
+        entry = DBSession.query(models.Entry).filter_by(name='qa').one()
+        return entry, res, queries
+
+    def test_detail(self):
+        small, _, queries = self.get_entry(NOUNS + entry_rows(2))
+        large, res, large_queries = self.get_entry(NOUNS + entry_rows(50))
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(len(large.unitvalues), 50)
+        self.assertIn('два 49', res.text)
+        self.assertIn('WER1', res.text)
+        self.assertLessEqual(len(large_queries), 8)
+        self.assertEqual(len(large_queries), len(queries))
+
+
+class StreamingDownloadTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        DBSession.remove()
+        shutil.rmtree(self.tmp)
+
+    def get(self, app, **headers):
+        res = Request.blank('/unitvalues.csv', headers=headers).get_response(app)
+        DBSession.remove()
+        return res
+
+    def test_conditional(self):
+        app = make_app(self.tmp)
+        util.set_data_version()
+        transaction.commit()
+        res = self.get(app)
+        self.assertEqual(res.status_int, 200)
+        self.assertIn('ambel', res.text)
+        self.assertEqual(self.get(app, **{'If-None-Match': res.headers['ETag']}).status_int, 304)
+
+        # Once the data has changed, a download made before is no longer valid:
+        DBSession.query(models.CounterpartSearch).filter_by(form='ambel').one().form = 'ambəl'
+        util.set_data_version()
+        transaction.commit()
+        res = self.get(app, **{'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_int, 200)
+        self.assertIn('ambəl', res.text)
+
+
+class VersionedCacheTests(TestCase):
+    def test_threads(self):
+        cache, calls = util.VersionedCache(), []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.01)
+            return len(calls)
+
+        with ThreadPoolExecutor(4) as executor:
+            res = list(executor.map(lambda i: cache.get('v1', 'key', compute), range(8)))
+        self.assertEqual(res, [1] * 8)
+        self.assertEqual(cache.get('v2', 'key', compute), 2)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        DBSession.remove()
+        testing.tearDown()
+
+    def test_FragmentCache(self):
+        req = testing.DummyRequest()
+        req.data_version = 'v1'
+        ctx = common.Unit(id='u1')
+        renderings = []
+
+        def render():
+            renderings.append(1)
+            return '<p>{0}</p>'.format(len(renderings))
+
+        cache = util.FragmentCache(maxsize=1)
+        self.assertEqual(cache.fragment(req, 'unit', ctx, 'content', render), '<p>1</p>')
+        self.assertEqual(cache.fragment(req, 'unit', ctx, 'content', render), '<p>1</p>')
+        # Only the least recently used fragment is kept in memory:
+        cache.fragment(req, 'unit', ctx, 'sidebar', render)
+        self.assertEqual(cache.fragment(req, 'unit', ctx, 'content', render), '<p>3</p>')
+        req.data_version = 'v2'
+        self.assertEqual(cache.fragment(req, 'unit', ctx, 'content', render), '<p>4</p>')
+
+        # Fragments on disk are shared:
+        cache = util.FragmentCache(directory=self.tmp)
+        cache.fragment(req, 'unit', ctx, 'content', render)
+        cache2 = util.FragmentCache(directory=self.tmp)
+        self.assertEqual(cache2.fragment(req, 'unit', ctx, 'content', render), '<p>5</p>')
+        cache.clear()
+        self.assertEqual(
+            util.FragmentCache(directory=self.tmp).fragment(req, 'unit', ctx, 'content', render),
+            '<p>6</p>')
+
+        # Fragments contain absolute links, so they are cached per host:
+        cache = util.FragmentCache()
+        cache.fragment(req, 'unit', ctx, 'content', render)
+        req.host_url = 'http://localhost'
+        self.assertEqual(cache.fragment(req, 'unit', ctx, 'content', render), '<p>8</p>')
+
+    def test_cached_detail(self):
+        testing.setUp()
+        import_data(BulkWriter, nouns=NOUNS + entry_rows(5))
+        entry = DBSession.query(models.Entry).filter_by(name='qa').one()
+        req = testing.DummyRequest(matchdict={'id': entry.id})
+        req.db, req.data_version = DBSession, 'v1'
+        DBSession.expunge_all()
+
+        util.FRAGMENTS.clear()
+        for name in ['content', 'sidebar']:
+            util.FRAGMENTS.set(util.FRAGMENTS.key(req, 'unit', entry.id, name), '<p></p>')
+        # If the page is cached, the data of the entry isn't loaded:
+        with count_queries() as queries:
+            CdkCtxFactoryQuery()(common.Unit, req)
+        self.assertEqual(len(queries), 1)
+        util.FRAGMENTS.clear()
+
+
+class ConditionalRequestsTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.app = make_app(self.tmp, **{'cdk.cache_max_age': '60'})
+        util.set_data_version()
+        transaction.commit()
+
+    def tearDown(self):
+        DBSession.remove()
+        shutil.rmtree(self.tmp)
+
+    def get(self, path, **headers):
+        res = Request.blank(path, headers=headers).get_response(self.app)
+        DBSession.remove()
+        return res
+
+    def test_conditional(self):
+        res = self.get('/units/1')
+        self.assertIn('Headword aˀt', res.text)
+        self.assertTrue(res.headers['ETag'].startswith('W/'))
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(res.headers['Vary'], 'Accept, X-Requested-With')
+        self.assertIsNotNone(res.last_modified)
+
+        # Matching requests are answered before the context is loaded and the view is
+        # called, with one query for the data-version stamp and one for the existence of
+        # the resource:
+        with count_queries() as queries:
+            res2 = self.get('/units/1', **{'If-None-Match': res.headers['ETag']})
+            self.assertEqual(res2.status_int, 304)
+            self.assertEqual(res2.headers['ETag'], res.headers['ETag'])
+            self.assertEqual(res2.headers['Vary'], 'Accept, X-Requested-With')
+            res2 = self.get('/units/2', **{'If-Modified-Since': res.headers['Last-Modified']})
+            self.assertEqual(res2.status_int, 304)
+        self.assertEqual(len(queries), 4)
+
+        # Resources which don't exist are not found, no matter what the client has cached:
+        res2 = self.get('/units/xyz', **{'If-Modified-Since': res.headers['Last-Modified']})
+        self.assertEqual(res2.status_int, 404)
+        self.assertNotIn('ETag', res2.headers)
+        req = Request.blank('/units/1', POST={}, headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(req.get_response(self.app).status_int, 200)
+        DBSession.remove()
+
+        # Representations negotiated for other Accept headers have ETags of their own:
+        res2 = self.get(
+            '/units/1', **{'If-None-Match': res.headers['ETag'], 'Accept': 'application/json'})
+        self.assertEqual(res2.status_int, 200)
+        self.assertEqual(res2.content_type, 'application/json')
+        self.assertNotEqual(res2.headers['ETag'], res.headers['ETag'])
+        self.assertEqual(
+            self.get('/units/1.json', **{'If-None-Match': res2.headers['ETag']}).status_int, 304)
+
+        # Datatables answer XHR requests for the same URL with the JSON data of their rows:
+        res2 = self.get('/unitvalues?sEcho=1')
+        self.assertEqual(res2.content_type, 'text/html')
+        res2 = self.get('/unitvalues?sEcho=1', **{
+            'If-None-Match': res2.headers['ETag'], 'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(res2.status_int, 200)
+        self.assertEqual(res2.json['sEcho'], '1')
+
+        # A new release of the app invalidates the ETag:
+        self.app.registry.settings['clld.git_tag'] = 'v2.0'
+        res2 = self.get('/units/1', **{'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res2.status_int, 200)
+
+        # A new data version invalidates the ETag:
+        etag = res2.headers['ETag']
+        util.set_data_version()
+        transaction.commit()
+        res2 = self.get('/units/1', **{'If-None-Match': etag})
+        self.assertEqual(res2.status_int, 200)
+        self.assertNotEqual(res2.headers['ETag'], etag)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        setup_data()
+        tweens.STATS.routes.clear()
+        config = testing.setUp()
+        config.add_tween('cdk.tweens.Profiling')
+        config.add_subscriber(tweens.profile_rendering, BeforeRender)
+        config.add_route('unit', '/units/{id}')
+        config.add_view(self.view, route_name='unit', renderer='string')
+        self.app = config.make_wsgi_app()
+
+    def tearDown(self):
+        testing.tearDown()
+        DBSession.remove()
+        tweens.STATS.routes.clear()
+
+    @staticmethod
+    def view(request):
+        class Lazy(object):
+            def __str__(self):
+                # A query run while rendering - like lazy loads in templates:
+                return DBSession.query(models.Entry.name).filter_by(id=request.matchdict['id'])\
+                    .scalar()
+
+        DBSession.query(models.Entry.id).all()
+        return Lazy()
+
+    def test_profiling(self):
+        with count_queries() as queries:
+            res = Request.blank('/units/1').get_response(self.app)
+        self.assertEqual(res.text, 'aˀt')
+        self.assertEqual(len(queries), 2)
+        timings = {
+            t.split(';')[0]: t for t in res.headers['Server-Timing'].split(', ')}
+        self.assertIn('desc="2 queries"', timings['sql'])
+        self.assertIn('desc="1 queries"', timings['render'])
+        self.assertIn('total', timings)
+
+        Request.blank('/units/2').get_response(self.app)
+        stats = views.profiling(testing.DummyRequest())
+        self.assertEqual(list(stats), ['unit'])
+        self.assertEqual(stats['unit']['requests'], 2)
+        self.assertEqual(stats['unit']['queries'], 2)
+        self.assertEqual(stats['unit']['render_queries'], 1)
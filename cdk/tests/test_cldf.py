@@ -0,0 +1,53 @@
+# coding: utf8
+from __future__ import unicode_literals, print_function, division
+from unittest import TestCase
+import shutil
+import zipfile
+import tempfile
+
+from csvw import TableGroup
+from clld.db.meta import DBSession
+
+from cdk import cldf
+from cdk.scripts.export_cldf import opener
+from cdk.tests.test_datatables import setup_data
+
+
+class CldfTests(TestCase):
+    def setUp(self):
+        setup_data()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        DBSession.remove()
+        shutil.rmtree(self.tmp)
+
+    def test_write(self):
+        with opener(self.tmp) as open_:
+            stats = cldf.write(open_, chunksize=2)
+        self.assertEqual(stats['entries.csv'], 8)
+        self.assertEqual(stats['senses.csv'], 9)
+
+        tg = TableGroup.from_file('{0}/Dictionary-metadata.json'.format(self.tmp))
+        self.assertTrue(tg.check_referential_integrity())
+        tables = {t.url.string: list(t.iterdicts()) for t in tg.tables}
+        for fname, rows in tables.items():
+            self.assertEqual(len(rows), stats[fname])
+        variants = [e for e in tables['entries.csv'] if e['Variant_Group']]
+        self.assertEqual(len(variants), 4)
+        self.assertEqual(len([e for e in variants if e['Variant']]), 3)
+        sense = tables['senses.csv'][0]
+        self.assertEqual((sense['Entry_ID'], sense['Description']), ('1', 'bone'))
+        self.assertEqual(len(sense['Example_IDs']), 4)
+        self.assertIn(
+            ['1[29]'], [ex['Source'] for ex in tables['examples.csv'] if ex['Source']])
+
+    def test_zip(self):
+        fname = '{0}/cdk.zip'.format(self.tmp)
+        with opener(fname) as open_:
+            cldf.write(open_)
+        with zipfile.ZipFile(fname) as zipf:
+            self.assertEqual(
+                sorted(zipf.namelist()),
+                sorted(['Dictionary-metadata.json', 'sources.bib'] +
+                       [fname for _, fname, _, _ in cldf.TABLES]))
@@ -0,0 +1,223 @@
+# coding: utf8
+from __future__ import unicode_literals, print_function, division
+from unittest import TestCase
+import json
+import contextlib
+
+from sqlalchemy import event
+from pyramid import testing
+from clld.db.meta import DBSession
+from clld.db.models import common
+
+from cdk import models, datatables, util, adapters
+from cdk.scripts.util import fill_counterpart_search
+from cdk.scripts.writer import BulkWriter
+from cdk.tests.test_load import import_data
+
+
+def setup_data():
+    import_data(BulkWriter)
+    DBSession.add(common.Dataset(id='cdk', name='CDK', domain='cdk.clld.org'))
+    DBSession.flush()
+    fill_counterpart_search()
+
+
+def get_request(**params):
+    req = testing.DummyRequest(params=params)
+    req.translate = lambda s: s
+    req.resource_url = lambda *args, **kw: '#'
+    req.data_version = util.data_version()
+    return req
+
+
+@contextlib.contextmanager
+def count_queries():
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    engine = DBSession.bind
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield queries
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class DatatableTests(TestCase):
+    def setUp(self):
+        testing.setUp()
+        setup_data()
+
+    def tearDown(self):
+        DBSession.remove()
+        testing.tearDown()
+
+    def test_cached_choices(self):
+        util.set_data_version()
+        cols = datatables.Entries(get_request(), models.Entry).cols
+        self.assertEqual(cols[5].choices, ['Russian'])
+
+        with count_queries() as queries:
+            datatables.Entries(get_request(), models.Entry).cols
+        self.assertFalse([q for q in queries if 'DISTINCT' in q or 'FROM language' in q])
+
+        DBSession.add(models.Entry(
+            id='x', name='x', language=common.Language.get('ket'), variant=False, donor='X'))
+        util.set_data_version()
+        DBSession.flush()
+        cols = datatables.Entries(get_request(), models.Entry).cols
+        self.assertEqual(cols[5].choices, ['Russian', 'X'])
+
+    def test_DialectCol(self):
+        util.set_data_version()
+        dt = datatables.Entries(get_request(), models.Entry)
+        self.assertEqual(dt.cols[6].choices[0], ('ket', 'Ket'))
+
+        for cls, model, index in [
+            (datatables.Entries, models.Entry, 6),
+            (datatables.Counterparts, models.CounterpartSearch, 9),
+        ]:
+            req = get_request(**{'sSearch_%s' % index: 'sket', 'iSortCol_0': str(index)})
+            items = cls(req, model).get_query().all()
+            self.assertEqual(len(items), 1)
+            req = get_request(**{'sSearch_%s' % index: 'xyz'})
+            self.assertEqual(cls(req, model).get_query().count(), 0)
+
+    def test_Examples(self):
+        def get_items(**params):
+            return datatables.Examples(get_request(**params), common.Sentence).get_query().all()
+
+        self.assertEqual(len(get_items()), DBSession.query(common.Sentence).count())
+        items = get_items(sSearch_2='Kellog')
+        self.assertEqual(len(items), 3)
+        self.assertTrue(all('Kellog' in [ex.location for ex in i.examples] for i in items))
+        items = get_items(sSearch_3='WER1', iSortingCols='1', iSortCol_0='2')
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].references[0].source.name, 'WER1')
+        items = get_items(iSortingCols='1', iSortCol_0='3', sSortDir_0='desc')
+        self.assertEqual(items[0].references[0].source.name, 'СНСС72')
+
+    def test_Counterparts(self):
+        def get_items(**params):
+            dt = datatables.Counterparts(get_request(**params), models.CounterpartSearch)
+            with count_queries() as queries:
+                items = dt.get_query().all()
+                rows = [[col.format(item) for col in dt.cols] for item in items]
+            # Counting, filtering and sorting is done on the search table only:
+            self.assertFalse([q for q in queries if 'JOIN' in q and 'counterpartsearch' in q])
+            return items, rows
+
+        items, rows = get_items()
+        self.assertEqual(len(items), DBSession.query(common.UnitValue).count())
+        items, rows = get_items(sSearch_8='Russian')
+        self.assertTrue(items)
+        self.assertTrue(all(i.counterpart.unit.donor == 'Russian' for i in items))
+        self.assertTrue(all(row[8] == 'Russian' for row in rows))
+        items, _ = get_items(sSearch_3='bone', iSortingCols='1', iSortCol_0='1')
+        self.assertEqual(len(items), 2)
+        self.assertTrue(all(i.counterpart.unitparameter.english == 'bone' for i in items))
+        self.assertEqual([i.form for i in items], sorted(i.form for i in items))
+
+        unit = DBSession.query(common.UnitValue).first().unit
+        dt = datatables.Counterparts(get_request(), models.CounterpartSearch, unit=unit)
+        self.assertEqual(
+            dt.get_query().count(),
+            DBSession.query(common.UnitValue).filter_by(unit_pk=unit.pk).count())
+
+    def test_keyset_pagination(self):
+        testing.setUp(settings={'cdk.keyset_pagination': 'true'})
+        for cls, model, params in [
+            (datatables.Counterparts, models.CounterpartSearch, dict(sSearch_8='Russian')),
+            (datatables.Counterparts, models.CounterpartSearch, dict(iSortCol_0='6')),
+            (datatables.Entries, models.Entry, dict(iSortCol_0='4', sSortDir_0='desc')),
+            (datatables.Examples, common.Sentence, dict(iSortCol_0='3')),
+            (datatables.Examples, common.Sentence, dict(iSortCol_0='2', sSortDir_0='desc')),
+        ]:
+            if 'iSortCol_0' in params:
+                params['iSortingCols'] = '1'
+            expected = [i.pk for i in cls(get_request(**params), model).get_query().all()]
+            items, start = [], 0
+            while start < len(expected) + 3:
+                dt = cls(get_request(iDisplayStart=str(start), iDisplayLength='3', **params), model)
+                dt.cols
+                with count_queries() as queries:
+                    query = dt.get_query()
+                # The cursor is taken from the items of the page served - no extra query is
+                # needed:
+                self.assertTrue(all('count(' in q for q in queries))
+                if 0 < start < len(expected):
+                    # All but the first page are selected by keyset:
+                    self.assertIn('{0}.pk > ?'.format(dt.db_model().__tablename__), str(query))
+                items.extend(i.pk for i in query)
+                start += 3
+            self.assertEqual(items, expected)
+
+        # Pages without known cursor are selected by offset:
+        query = datatables.Entries(
+            get_request(iDisplayStart='2', iDisplayLength='3'), models.Entry).get_query()
+        self.assertNotIn('entry.pk > ?', str(query))
+        self.assertEqual(
+            [i.pk for i in query],
+            [i.pk for i in DBSession.query(models.Entry).order_by(models.Entry.pk)][2:5])
+
+    def test_download(self):
+        util.set_data_version()
+
+        def download(adapter, cls, model, **params):
+            # Fill the cache of the choices of the columns:
+            cls(get_request(**params), model).cols
+            res = []
+            for chunksize in [2, 1000]:
+                dt, adapter_ = cls(get_request(**params), model), adapter(None)
+                adapter_.chunksize = chunksize
+                with count_queries() as queries:
+                    body = b''.join(adapter_.render_to_response(dt, dt.req).app_iter)
+                res.append((body.decode('utf8'), len(queries)))
+            # The rows are read with one query, no matter how many chunks are sent:
+            self.assertEqual(res[0], res[1])
+            return res[0][0].splitlines()
+
+        # The complete result is downloaded, filtered and sorted as in the datatable:
+        lines = download(
+            adapters.CsvIndex, datatables.Counterparts, models.CounterpartSearch,
+            iSortingCols='1', iSortCol_0='1', iDisplayLength='2', iDisplayStart='2')
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'form'])
+        self.assertEqual(len(lines) - 1, DBSession.query(common.UnitValue).count())
+        forms = [line.split(',')[1] for line in lines[1:]]
+        self.assertEqual(forms, sorted(forms))
+        lines = download(
+            adapters.CsvIndex, datatables.Counterparts, models.CounterpartSearch,
+            sSearch_8='Russian')
+        self.assertEqual(lines[1:], ['7-1,ambel,False,good,хороший,adjective,,,Russian,Ket'])
+
+        lines = download(
+            adapters.NdjsonIndex, datatables.Examples, common.Sentence, sSearch_3='WER1')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            json.loads(lines[0]),
+            dict(id='12', text='qīp thitsut [thitsuʁut]', translation='луна заходит',
+                 language='Southern Ket', settlement='Southern Ket', source='WER1'))
+
+    def test_WordCol(self):
+        for cls, model, index in [
+            (datatables.Entries, models.Entry, 0),
+            (datatables.Counterparts, models.CounterpartSearch, 1),
+        ]:
+            def get_names(qs):
+                dt = cls(get_request(**{'sSearch_%s' % index: qs}), model)
+                return set(dt.cols[index].get_obj(i).name for i in dt.get_query())
+
+            self.assertEqual(get_names('AnAt'), {'anát-qodes', 'anát-qɔrεs', 'anát-qɔdεs'})
+            self.assertEqual(get_names('anat-qor'), {'anát-qɔrεs'})
+            self.assertEqual(get_names('at'), {'aˀt'})
+            self.assertEqual(get_names('nat'), set())
+
+        # Forms with characters outside the BMP are found, too:
+        self.assertEqual(datatables.prefix_end('ab'), 'ac')
+        self.assertEqual(datatables.prefix_end('a\U0010ffff'), 'b')
+        self.assertIsNone(datatables.prefix_end('\U0010ffff'))
+        entry = DBSession.query(models.Entry).filter_by(name='ambel').one()
+        entry.normalized = 'ambel\U0001d51e'
+        DBSession.flush()
+        dt = datatables.Entries(get_request(sSearch_0='ambel'), models.Entry)
+        self.assertEqual([i.name for i in dt.get_query()], ['ambel'])
@@ -0,0 +1,85 @@
+# coding: utf8
+from __future__ import unicode_literals, print_function, division
+from unittest import TestCase
+
+from sqlalchemy import text
+from pyramid import testing
+from pyramid.httpexceptions import HTTPBadRequest
+from clld.db.meta import DBSession
+from clld.db.models import common
+
+from cdk import models, datatables, fts, views, util
+from cdk.tests.test_datatables import setup_data, get_request
+
+
+class FullTextTests(TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        for type_ in fts.TYPES:
+            self.config.add_route(type_, '/{0}s/{{id}}'.format(type_))
+        setup_data()
+        self.n = fts.build_index(chunksize=3)
+
+    def tearDown(self):
+        DBSession.remove()
+        testing.tearDown()
+
+    def test_fold(self):
+        self.assertEqual(util.fold('anát-qɔrεs'), 'anat-qɔrεs')
+        self.assertEqual(util.fold('Кость'), 'кость')
+        self.assertEqual(util.normalize('alʲəbɛt'), 'alebet')
+        self.assertEqual(util.normalize('ε(j)štij'), 'ejstij')
+        self.assertEqual(util.normalize('Kɔˀ2'), 'ko')
+
+    def test_search(self):
+        self.assertEqual(
+            self.n,
+            DBSession.query(models.Entry).count() + DBSession.query(models.Meaning).count() +
+            DBSession.query(common.Sentence).count())
+        self.assertEqual(fts.search(' ,'), [])
+
+        res = fts.search('КОСТ', type_='unitparameter')
+        self.assertTrue(res)
+        self.assertTrue(all(r['type'] == 'unitparameter' for r in res))
+        # Forms are matched by normalized form:
+        self.assertEqual(
+            sorted(r['label'] for r in fts.search('anat qodes', type_='unit')),
+            ['anát-qodes', 'anát-qɔdεs'])
+        self.assertEqual([r['label'] for r in fts.search('boltaq')], ['boltaq'])
+        self.assertEqual([r['label'] for r in fts.search('aˀt', type_='unit')], ['aˀt'])
+        self.assertTrue(fts.search('месяц сел', type_='sentence'))
+
+    def test_datatables(self):
+        def get_items(cls, model, q):
+            return cls(get_request(q=q), model).get_query().all()
+
+        items = get_items(datatables.Entries, models.Entry, 'anat')
+        self.assertEqual(
+            sorted(i.pk for i in items),
+            sorted(e.pk for e in DBSession.query(models.Entry) if e.name.startswith('anát')))
+        items = get_items(datatables.Counterparts, models.CounterpartSearch, 'knochen')
+        self.assertEqual(len(items), 2)
+        self.assertTrue(all(i.english == 'bone' for i in items))
+        items = get_items(datatables.Examples, common.Sentence, 'кость')
+        self.assertTrue(items)
+        self.assertTrue(all('кость' in i.description for i in items))
+
+        dt = datatables.Examples(get_request(q='кость'), common.Sentence)
+        self.assertEqual(dt.xhr_query()['q'], 'кость')
+
+    def test_without_index(self):
+        DBSession.execute(text('DROP TABLE fulltext'))
+        # The search is ignored until the index is built:
+        self.assertEqual(
+            datatables.Entries(get_request(q='anat'), models.Entry).get_query().count(),
+            DBSession.query(models.Entry).count())
+        self.assertEqual(fts.search('anat'), [])
+
+    def test_view(self):
+        res = views.fulltext(get_request(q='ум', type='unitparameter'))
+        meaning = DBSession.query(models.Meaning).filter_by(russian='ум').one()
+        self.assertEqual(
+            res['results'][0]['url'],
+            'http://example.com/unitparameters/{0}'.format(meaning.id))
+        with self.assertRaises(HTTPBadRequest):
+            views.fulltext(get_request(q='ум', type='language'))
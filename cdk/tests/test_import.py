@@ -1,8 +1,17 @@
 # coding: utf8
 from __future__ import unicode_literals, print_function, division
 from unittest import TestCase
+import os
+import io
+import json
+import random
+import shutil
+import tempfile
 
-from cdk.scripts.util import Headword, yield_variants, yield_examples
+from cdk.scripts.util import (
+    Headword, yield_variants, yield_examples, yield_cited_examples, ProblemLog,
+    split_locations, LOC_PATTERN, LOCATIONS, ParseCache, parse_examples,
+)
 
 
 class HeadwordTests(TestCase):
@@ -323,6 +332,27 @@ class HeadwordTests(TestCase):
         #
         self.assertEqual(len(l), 9)
 
+    def test_split_locations(self):
+        for s in [
+            '',
+            'kel. abc',
+            ' kel. abc',
+            '  kel. abc',
+            'abc kel. def',
+            'abc  kel. def, sul.def, bak.  ghi',
+            'abc]kel. def! sul.,  ghi?  ,ke. jkl',
+            'e.-o. abc,kel.  sul. def',
+            'abc.  bakh. def  bakht.\tghi',
+            'x  xkel. abc  el. def',
+        ]:
+            self.assertEqual(split_locations(s), LOC_PATTERN.split(s))
+
+        atoms = list(LOCATIONS) + ['ket', 'xkel', '.', '.,', ',', ' ', '  ', ']', '?', 'a']
+        rnd = random.Random(1)
+        for _ in range(2000):
+            s = ''.join(rnd.choice(atoms) for _ in range(rnd.randint(0, 12)))
+            self.assertEqual(split_locations(s), LOC_PATTERN.split(s))
+
     def test_variants(self):
         l = list(yield_variants('sket.'))
         self.assertEqual(l, [('sket', None)])
@@ -341,3 +371,70 @@ class HeadwordTests(TestCase):
 
         l = list(yield_variants('nket. a, sket., cket. b, c'))
         self.assertEqual(l, [('nket', 'a'), ('sket', 'b'), ('cket', 'b'), ('sket', 'c'), ('cket', 'c')])
+
+
+class ProblemLogTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_ProblemLog(self):
+        fname = os.path.join(self.tmp, 'problems.jsonl')
+        problems = ProblemLog(fname)
+        problems.row = 5
+        list(yield_examples('kel. abcd efgh', problems=problems))
+        Headword('ambel <xyz.>', problems=problems)
+        self.assertEqual(len(problems), 2)
+        self.assertEqual(problems.counts[('Headword', 'unknown donor')], 1)
+        self.assertFalse(os.path.exists(fname))
+
+        problems.flush()
+        problems.row = 6
+        list(yield_cited_examples('abcd (КФТ: 1) efgh', problems=problems))
+        problems.flush()
+        with io.open(fname, encoding='utf8') as fp:
+            lines = [json.loads(line) for line in fp]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]['row'], 5)
+        self.assertEqual(lines[0]['stage'], 'yield_examples')
+        self.assertEqual(lines[0]['string'], 'kel. abcd efgh')
+        self.assertEqual(lines[2]['row'], 6)
+
+    def test_ParseCache(self):
+        cache = ParseCache(os.path.join(self.tmp, 'cache.sqlite'))
+        problems = ProblemLog()
+        for row in [1, 2]:
+            problems.row = row
+            res = cache(parse_examples, 'kel. abcd efgh', problems)
+            self.assertEqual([list(r) for r in res], [['kel', 'abcd efgh', '', None, None]])
+            cache.add(cache.pop_new())
+        self.assertEqual(len(cache), 1)
+        self.assertEqual([p['row'] for p in problems.items], [1, 2])
+        cache.close()
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_benchmark(self):
+        from cdk.scripts import benchmark
+
+        corpus = benchmark.synthetic_corpus(50)
+        self.assertEqual(len(corpus['headwords']), 50)
+        for headword in corpus['headwords']:
+            Headword(headword)
+
+        fname = os.path.join(self.tmp, 'baseline.json')
+        self.assertEqual(benchmark.main(['--synthetic', '--size', '20', '--repeat', '1', '--save', fname]), 0)
+        with io.open(fname, encoding='utf8') as fp:
+            results = json.load(fp)['results']
+        self.assertIn('yield_examples', results)
+        self.assertEqual(benchmark.compare(results, results), [])
+        self.assertEqual(
+            benchmark.compare(results, {'form': results['form'] * 2}), ['form'])
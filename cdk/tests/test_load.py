@@ -0,0 +1,217 @@
+# coding: utf8
+from __future__ import unicode_literals, print_function, division
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from collections import Counter
+from itertools import count, islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import transaction
+from sqlalchemy import create_engine
+from clld.cliutil import Data
+from clld.db.meta import DBSession, Base
+from clld.db.models import common
+
+from cdk import models
+from cdk.scripts import util
+from cdk.scripts.writer import OrmWriter, BulkWriter
+from cdk.scripts.timing import Timer
+from cdk.scripts.samples import NOUNS, VERBS
+
+
+def setup_db(url='sqlite://'):
+    DBSession.remove()
+    engine = create_engine(url)
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+    data = Data()
+    contrib = common.Contribution(id='ket', name='CDK')
+    DBSession.add(contrib)
+    ket = data.add(common.Language, 'ket', id='ket', name='Ket')
+    for abbr, name in util.DIALECTS.items():
+        data.add(common.Language, abbr, id=abbr, name=name)
+    for i, src in enumerate(['КФТ', 'СНСС72', 'WER1']):
+        data.add(common.Source, src, id=str(i + 1), name=src)
+    return data, ket, contrib
+
+
+def import_data(
+        writer_cls, executor=None, nouns=NOUNS, cache=None, timer=None, url='sqlite://', **kw):
+    data, ket, contrib = setup_db(url)
+    ctx = util.ImportContext(data, writer_cls(data, **kw), cache=cache, timer=timer)
+    util.load(ctx, iter(nouns), ket, contrib, verbs=False, executor=executor)
+    util.load(ctx, iter(VERBS), ket, contrib, executor=executor)
+    ctx.writer.close()
+    return dump()
+
+
+def update_data(nouns):
+    data = Data()
+    for lang in DBSession.query(common.Language):
+        data['Language'][lang.id] = lang
+    for src in DBSession.query(common.Source):
+        data['Source'][src.name] = src
+    ctx = util.ImportContext.from_db(data, BulkWriter(data))
+    stats = util.update_groups(
+        ctx, iter(nouns), data['Language']['ket'], common.Contribution.get('ket'), verbs=False)
+    ctx.writer.close()
+    util.delete_orphans()
+    return stats
+
+
+def content():
+    """The data, independent of primary keys and IDs."""
+    return sorted(
+        (uv.unit.name,
+         uv.unit.language.id,
+         uv.unitparameter.name,
+         tuple(sorted(
+             (ex.location or '', ex.sentence.name, ex.sentence.description)
+             for ex in uv.examples)),
+         tuple(sorted(v.name for _, vs in uv.unit.variants for v in vs)))
+        for uv in DBSession.query(common.UnitValue))
+
+
+def dump():
+    res = {}
+    for table in Base.metadata.sorted_tables:
+        cols = [c for c in table.c if c.key not in ['created', 'updated']]
+        res[table.name] = [
+            tuple(row) for row in DBSession.execute(
+                table.select().with_only_columns(cols).order_by(table.c.pk))]
+    return res
+
+
+class LoadTests(TestCase):
+    def tearDown(self):
+        DBSession.remove()
+
+    def test_load(self):
+        db = import_data(OrmWriter)
+        self.assertEqual(len(db['meaning']), 5)
+        self.assertEqual(len(db['variantgroup']), 1)
+        self.assertEqual(
+            DBSession.query(models.Entry).filter(models.Entry.variantgroup_pk.isnot(None)).count(),
+            4)
+        self.assertEqual(len(db['sentencereference']), 5)
+
+    def test_bulk_load(self):
+        orm = import_data(OrmWriter)
+        self.assertEqual(import_data(BulkWriter), orm)
+        self.assertEqual(import_data(BulkWriter, chunksize=10), orm)
+
+    def test_parallel_load(self):
+        orm = import_data(OrmWriter)
+        with ProcessPoolExecutor(2) as executor:
+            self.assertEqual(import_data(BulkWriter, executor=executor), orm)
+
+    def test_cached_load(self):
+        orm = import_data(OrmWriter)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        fname = os.path.join(tmp, 'cache.sqlite')
+
+        cache = util.ParseCache(fname)
+        self.assertEqual(import_data(BulkWriter, cache=cache), orm)
+        self.assertEqual(len(cache), cache.added)
+        added = cache.added
+        self.assertEqual(import_data(BulkWriter, cache=cache), orm)
+        self.assertEqual(cache.added, added)
+        cache.close()
+
+        cache = util.ParseCache(fname)
+        with ProcessPoolExecutor(2) as executor:
+            self.assertEqual(import_data(BulkWriter, executor=executor, cache=cache), orm)
+        self.assertEqual(cache.added, 0)
+        cache.close()
+
+        # Results parsed in parallel by several workers are only counted once:
+        os.remove(fname)
+        cache = util.ParseCache(fname)
+        nouns = NOUNS + [['aˀq', 'n', '', 'лодка', 'Boot', 'boat', NOUNS[1][6]]]
+        with ProcessPoolExecutor(2) as executor:
+            import_data(BulkWriter, executor=executor, cache=cache, nouns=nouns)
+        self.assertEqual(cache.added, len(cache))
+        cache.close()
+
+        # Results of other parser versions are discarded:
+        self.assertEqual(len(util.ParseCache(fname, version='other')), 0)
+
+    def test_timing(self):
+        timer = Timer()
+        with ProcessPoolExecutor(2) as executor:
+            import_data(BulkWriter, executor=executor, timer=timer)
+        self.assertEqual(timer.stats['read CSV'][0], len(NOUNS) + len(VERBS))
+        self.assertEqual(timer.stats['parse headwords'][0], 5)
+        self.assertEqual(timer.stats['parse examples'][0], 6)
+        self.assertEqual(timer.stats['create variant groups'][0], 1)
+        self.assertIn('create meanings/examples', timer.report())
+
+    def test_update(self):
+        nouns = [row[:] for row in NOUNS]
+        nouns[4][6] = "pak. qūsʲ aˀt  одна кость"  # changed
+        del nouns[5]  # removed
+        nouns.append(['aˀq', 'n', '', 'лодка', 'Boot', 'boat', "kel. aˀq  лодка"])  # new
+        import_data(BulkWriter, nouns=nouns)
+        expected = content()
+
+        import_data(OrmWriter)
+        ids = {(e.name, e.language.id): e.id for e in DBSession.query(models.Entry)}
+        stats = update_data(nouns)
+        self.assertEqual(stats, dict(unchanged=2, changed=1, new=1, removed=1))
+        self.assertEqual(content(), expected)
+        for e in DBSession.query(models.Entry):
+            if e.name != 'aˀq':
+                self.assertEqual(e.id, ids[(e.name, e.language.id)])
+        self.assertEqual(DBSession.query(models.HeadwordGroup).count(), 5)
+        self.assertIsNone(DBSession.query(common.Sentence).filter_by(name='kel. hɨlʲ').first())
+        # Nothing changed:
+        self.assertEqual(update_data(nouns), Counter(unchanged=4))
+
+        util.delete_groups(DBSession.query(models.HeadwordGroup))
+        self.assertEqual(DBSession.query(models.Entry).count(), 0)
+        self.assertEqual(DBSession.query(models.VariantGroup).count(), 0)
+
+    def test_update_committed(self):
+        nouns = [row[:] for row in NOUNS]
+        nouns[4][6] = "pak. qūsʲ aˀt  одна кость"
+        del nouns[5]
+        import_data(BulkWriter, nouns=nouns)
+        expected = content()
+        transaction.abort()
+
+        import_data(BulkWriter)
+        transaction.commit()
+        # The update writes with Core statements only - which must be committed nonetheless:
+        with transaction.manager:
+            update_data(nouns)
+        DBSession.remove()
+        self.assertEqual(content(), expected)
+
+    def test_update_without_bookkeeping(self):
+        import_data(BulkWriter)
+        # A database created by an import predating incremental updates:
+        DBSession.query(models.HeadwordGroup).delete()
+        self.assertRaises(ValueError, update_data, NOUNS)
+        self.assertEqual(DBSession.query(models.Entry).count(), 8)
+
+
+class StreamingTests(TestCase):
+    def test_iter_chunks(self):
+        text = 'a\n\n\nbc\nd\n\n\n\n\n\ne\n'
+        for size in [1, 2, 3, 5, 100]:
+            self.assertEqual(
+                list(util.iter_chunks(io.StringIO(text), '\n\n\n', size=size)),
+                text.split('\n\n\n'))
+
+    def test_bounded_map(self):
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(
+                list(util.bounded_map(executor, str, range(250), chunksize=7)),
+                [str(i) for i in range(250)])
+            # The input is consumed lazily, so it may even be infinite:
+            self.assertEqual(
+                list(islice(util.bounded_map(executor, abs, count()), 3)), [0, 1, 2])
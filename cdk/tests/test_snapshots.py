@@ -0,0 +1,80 @@
+# coding: utf8
+from __future__ import unicode_literals, print_function, division
+from unittest import TestCase
+import os
+import gzip
+import json
+import uuid
+import shutil
+import tempfile
+
+from pyramid import testing
+from pyramid.request import Request
+from pyramid.httpexceptions import HTTPNotFound
+from clld.db.meta import DBSession
+
+from cdk import snapshots, views
+from cdk.tests.test_datatables import setup_data, count_queries
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        setup_data()
+        self.tmp = tempfile.mkdtemp()
+        self.config = testing.setUp(settings={'cdk.snapshot_dir': self.tmp})
+
+    def tearDown(self):
+        testing.tearDown()
+        DBSession.remove()
+        shutil.rmtree(self.tmp)
+
+    def get(self, type_, id_, **headers):
+        req = Request.blank('/snapshots/{0}/{1}.json'.format(type_, id_), headers=headers)
+        req.registry = self.config.registry
+        req.matchdict = {'type': type_, 'id': id_}
+        # Run the response as WSGI app, to handle conditional requests:
+        return req.get_response(views.snapshot(req))
+
+    def test_write(self):
+        v1, v2 = uuid.uuid4().hex, uuid.uuid4().hex
+        os.mkdir(os.path.join(self.tmp, 'static'))
+        with count_queries() as queries:
+            self.assertEqual(snapshots.write(self.tmp, v1, chunksize=3), dict(unit=8, sentence=14))
+        n = len(queries)
+        with count_queries() as queries:
+            snapshots.write(self.tmp, v2, chunksize=100)
+        # Each chunk of objects is loaded with a fixed number of queries:
+        self.assertLess(len(queries), n)
+        # Only the snapshots of other data versions are removed:
+        self.assertEqual(sorted(os.listdir(self.tmp)), sorted(['current', 'static', v2]))
+
+        fname = snapshots.path(os.path.join(self.tmp, 'current'), 'unit', '2')
+        with gzip.open(fname) as fp:
+            entry = json.loads(fp.read().decode('utf8'))
+        self.assertEqual(entry['name'], 'anát-qodes')
+        self.assertEqual(len(entry['variants']), 3)
+        self.assertEqual(entry['meanings'][0]['english'], 'mind')
+        self.assertEqual(len(entry['meanings'][0]['examples']), 2)
+
+    def test_view(self):
+        snapshots.write(self.tmp, uuid.uuid4().hex)
+        res = self.get('sentence', '12', **{'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(res.content_encoding, 'gzip')
+        self.assertEqual(
+            json.loads(gzip.decompress(res.body).decode('utf8'))['references'][0]['name'],
+            'WER1')
+        self.assertEqual(self.get('sentence', '12', **{'If-None-Match': res.etag}).status_int, 200)
+        self.assertEqual(
+            self.get('sentence', '12', **{
+                'If-None-Match': res.etag, 'Accept-Encoding': 'gzip'}).status_int,
+            304)
+
+        res = self.get('sentence', '12')
+        self.assertIsNone(res.content_encoding)
+        self.assertEqual(res.json['text'], 'qīp thitsut [thitsuʁut]')
+
+        with count_queries() as queries:
+            self.get('unit', '2')
+        self.assertEqual(queries, [])
+        self.assertRaises(HTTPNotFound, self.get, 'unit', 'xyz')
+        self.assertRaises(HTTPNotFound, self.get, 'unitvalue', '2')
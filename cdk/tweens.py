@@ -0,0 +1,254 @@
+"""
+Tweens wrapping the request handling of the app.
+"""
+import time
+import functools
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from pyramid.interfaces import IRoutesMapper
+from pyramid.httpexceptions import HTTPNotModified
+from clld.interfaces import IRepresentation, IIndex
+from clld.web.app import ctx_factory
+from clld.web.adapters import get_adapter
+
+
+def cache_control(settings):
+    """
+    :return: `Cache-Control` header for responses which may be cached for the number of \
+    seconds configured as `cdk.cache_max_age`, e.g. by a front proxy.
+    """
+    return 'public, max-age={0}'.format(int(settings.get('cdk.cache_max_age', 0)))
+
+
+def resource(request):
+    """
+    Look up the resource requested - without running the context factory.
+
+    :return: `(model, type, matchdict)` triple for routes of the resources and indexes of \
+    clld - with type `rsc` or `index`, as passed to `clld.web.app.ctx_factory` - or `None`.
+    """
+    info = request.registry.getUtility(IRoutesMapper)(request)
+    factory = info['route'].factory if info['route'] else None
+    if isinstance(factory, functools.partial) and factory.func is ctx_factory:
+        model, type_ = factory.args
+        return model, type_, info['match']
+
+
+# Request headers, by which the representations - and ETags - of resources vary:
+VARY = ('Accept', 'X-Requested-With')
+
+
+class ConditionalRequests(object):
+    """
+    Conditional requests for the resources and indexes of the app, validated by the
+    data-version stamp.
+
+    The responses only change when the data or the app does, so the data version - with
+    the release of the app, the locale, the mimetype negotiated for the `Accept` header and
+    whether the request is an XHR - serves as ETag and the time of the change as
+    Last-Modified date. Requests with matching `If-None-Match` or `If-Modified-Since`
+    headers for resources which exist are answered with 304 before the context is loaded
+    or the view is called.
+    """
+    def __init__(self, handler, registry):
+        self.handler = handler
+        self.cache_control = cache_control(registry.settings)
+
+    def etag(self, request):
+        """
+        :return: ETag of the response to a request - or `None` if the request has none, e.g. \
+        because the resource does not exist or no representation is acceptable.
+        """
+        rsc = resource(request) if request.method in ['GET', 'HEAD'] else None
+        if not rsc or not request.data_stamp['version']:
+            return None
+        model, type_, match = rsc
+        if type_ == 'rsc' and 'id' in match and not request.db.query(
+                request.db.query(model).filter(model.id == match['id']).exists()).scalar():
+            return None
+        # Negotiate the representation like `clld.web.views.view` does:
+        adapter = get_adapter(
+            IRepresentation if type_ == 'rsc' else IIndex,
+            model(),
+            request,
+            ext=match.get('ext'))
+        if not adapter:
+            return None
+        return '-'.join([
+            request.data_stamp['version'],
+            request.registry.settings.get('clld.git_tag') or '',
+            request.locale_name,
+            adapter.mimetype,
+            # XHR requests for the same URL - e.g. for the rows of a datatable - are
+            # answered with other content:
+            'xhr' if request.is_xhr else ''])
+
+    def __call__(self, request):
+        etag = self.etag(request)
+        if not etag:
+            return self.handler(request)
+
+        updated = request.data_stamp['updated']
+        if etag in request.if_none_match or (
+                not request.if_none_match and
+                updated and
+                request.if_modified_since and
+                updated <= request.if_modified_since):
+            response = HTTPNotModified()
+        else:
+            response = self.handler(request)
+            if response.status_int != 200 or response.etag:
+                return response
+
+        # Weak validators, because responses may be compressed on the way to the client:
+        response.etag = (etag, False)
+        response.last_modified = updated
+        response.cache_control = self.cache_control
+        response.vary = tuple(v for v in response.vary or () if v not in VARY) + VARY
+        return response
+
+
+class Profile(object):
+    """
+    Number and time of the queries of a request and the time spent rendering its template.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.queries = 0
+        self.sql = 0.0
+        self.render_start = None
+        self.render_queries = 0
+
+    def before_render(self):
+        # Templates may render other templates - we time the outermost one:
+        if self.render_start is None:
+            self.render_start = time.perf_counter()
+            self.render_queries = self.queries
+
+    def finish(self):
+        self.end = time.perf_counter()
+        if self.render_start is not None:
+            self.render_queries = self.queries - self.render_queries
+
+    @property
+    def total(self):
+        return self.end - self.start
+
+    @property
+    def render(self):
+        return self.end - self.render_start if self.render_start is not None else 0.0
+
+    def server_timing(self):
+        """
+        :return: Value of the `Server-Timing` header, with durations in milliseconds.
+        """
+        return ', '.join([
+            'sql;dur={0:.1f};desc="{1} queries"'.format(self.sql * 1000, self.queries),
+            'render;dur={0:.1f};desc="{1} queries"'.format(
+                self.render * 1000, self.render_queries),
+            'total;dur={0:.1f}'.format(self.total * 1000),
+        ])
+
+
+class ProfilingStats(object):
+    """
+    Profiles of the requests served by the process, aggregated per route.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def add(self, route, profile):
+        with self.lock:
+            stats = self.routes.setdefault(route, dict(
+                requests=0, queries=0, max_queries=0, render_queries=0,
+                sql=0.0, render=0.0, total=0.0, max_total=0.0))
+            stats['requests'] += 1
+            stats['queries'] += profile.queries
+            stats['max_queries'] = max(stats['max_queries'], profile.queries)
+            stats['render_queries'] += profile.render_queries
+            stats['sql'] += profile.sql
+            stats['render'] += profile.render
+            stats['total'] += profile.total
+            stats['max_total'] = max(stats['max_total'], profile.total)
+
+    def summary(self):
+        """
+        :return: `dict` mapping route names to mean and maximal numbers of queries and \
+        durations in milliseconds.
+        """
+        with self.lock:
+            return {route: dict(
+                requests=stats['requests'],
+                queries=round(stats['queries'] / stats['requests'], 1),
+                max_queries=stats['max_queries'],
+                render_queries=round(stats['render_queries'] / stats['requests'], 1),
+                sql_ms=round(stats['sql'] * 1000 / stats['requests'], 1),
+                render_ms=round(stats['render'] * 1000 / stats['requests'], 1),
+                total_ms=round(stats['total'] * 1000 / stats['requests'], 1),
+                max_total_ms=round(stats['max_total'] * 1000, 1),
+            ) for route, stats in self.routes.items()}
+
+
+STATS = ProfilingStats()
+# The profile of the request handled by the current thread:
+_current = threading.local()
+
+
+def current_profile():
+    return getattr(_current, 'profile', None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('cdk.query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['cdk.query_start'].pop()
+    profile = current_profile()
+    if profile:
+        profile.queries += 1
+        profile.sql += time.perf_counter() - start
+
+
+def profile_rendering(event):
+    """
+    Subscriber to `pyramid.events.BeforeRender`, marking the start of the rendering.
+    """
+    profile = current_profile()
+    if profile:
+        profile.before_render()
+
+
+class Profiling(object):
+    """
+    Profiling of the requests - enabled with setting `cdk.profiling`.
+
+    Queries - counted and timed via the events of all SQLAlchemy engines - and the time
+    spent rendering templates are reported in the `Server-Timing` header of each response
+    and aggregated per route in `STATS`, served at `/_profiling`. Rendering is timed from
+    the first `BeforeRender` event to the end of the request, so it includes the queries
+    of lazy loads in templates. Queries of streamed responses are not counted.
+    """
+    def __init__(self, handler, registry):
+        self.handler = handler
+        for name, listener in [
+            ('before_cursor_execute', before_cursor_execute),
+            ('after_cursor_execute', after_cursor_execute),
+        ]:
+            if not event.contains(Engine, name, listener):
+                event.listen(Engine, name, listener)
+
+    def __call__(self, request):
+        _current.profile = profile = Profile()
+        try:
+            response = self.handler(request)
+        finally:
+            _current.profile = None
+        profile.finish()
+        STATS.add(request.matched_route.name if request.matched_route else None, profile)
+        response.headers['Server-Timing'] = profile.server_timing()
+        return response
@@ -1,11 +1,29 @@
+# coding: utf8
+import os
 import re
+import io
+import uuid
+import hashlib
+import threading
+import tempfile
+import unicodedata
+from datetime import datetime, timezone
 from itertools import groupby
+from collections import OrderedDict
 
 from markupsafe import Markup
 
+from clld.db.meta import DBSession
+from clld.db.models import common
+from clld.db.util import get_distinct_values
 from clld.web.util.helpers import get_referents
 
 DIGIT = re.compile('(?P<digit>\d)')
+# Palatalization and glottalization marks and brackets around optional sounds, which are
+# left out of normalized forms:
+MARKS = re.compile(r'[ʲˀ()\[\]]')
+# Letters of the transcription which users will type as their basic latin counterparts:
+LETTERS = {ord(k): v for k, v in {'ε': 'e', 'ɛ': 'e', 'ɔ': 'o', 'ə': 'e', 'ǝ': 'e'}.items()}
 
 
 def source_detail_html(context=None, request=None, **kw):
@@ -20,3 +38,222 @@ def examples_by_location(counterpart):
 
 def form(s):
     return Markup(DIGIT.sub(lambda m: '<sup>%s</sup>' % m.group('digit'), s))
+
+
+def fold(s):
+    """
+    Strip diacritics from `s` and casefold it.
+    """
+    return ''.join(
+        c for c in unicodedata.normalize('NFKD', s or '')
+        if not unicodedata.combining(c)).casefold()
+
+
+def normalize(form):
+    """
+    Normalized form for lookup, disregarding diacritics, case, palatalization and the digits
+    distinguishing homonyms - e.g. "alebet" for "alʲəbɛt".
+    """
+    return fold(MARKS.sub('', DIGIT.sub('', form or ''))).translate(LETTERS)
+
+
+def data_stamp(req=None):
+    """
+    The data-version stamp, renewed by `set_data_version` whenever the data is changed, as
+    dict with keys `version` and `updated` - the time of the change as `datetime`.
+
+    Registered as reified request property `data_stamp` - i.e. looked up once per request.
+    """
+    row = DBSession.query(common.Dataset.jsondata).first()
+    jsondata = (row[0] if row else None) or {}
+    updated = jsondata.get('data_updated')
+    return dict(
+        version=jsondata.get('data_version'),
+        updated=datetime.fromisoformat(updated) if updated else None)
+
+
+def data_version(req=None):
+    """
+    The version of the data-version stamp.
+
+    Registered as reified request property `data_version`.
+    """
+    return (req.data_stamp if req is not None else data_stamp())['version']
+
+
+def set_data_version():
+    dataset = DBSession.query(common.Dataset).first()
+    dataset.jsondata = dict(
+        dataset.jsondata or {},
+        data_version=uuid.uuid4().hex,
+        # HTTP dates have a resolution of seconds:
+        data_updated=datetime.now(timezone.utc).replace(microsecond=0).isoformat())
+    return dataset.jsondata['data_version']
+
+
+class VersionedCache(object):
+    """
+    Process-wide cache for data computed from the database, which is discarded when the
+    data version changes.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.values = {}
+
+    def get(self, version, key, func):
+        """
+        :param version: The current data version.
+        :return: The cached value for `key` - computed by calling `func` if necessary.
+        """
+        # The cache is shared by the threads serving requests, and values are computed
+        # only once:
+        with self.lock:
+            if version != self.version:
+                self.version, self.values = version, {}
+            if key not in self.values:
+                self.values[key] = func()
+            return self.values[key]
+
+
+CACHE = VersionedCache()
+
+
+class LRUCache(object):
+    """
+    Process-wide cache holding at most `maxsize` items, discarding the least recently used
+    items first.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        # Reordering the items is not atomic, so requests served by other threads must wait:
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.values:
+                return default
+            self.values.move_to_end(key)
+            return self.values[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+
+
+# Keyset pagination cursors of datatables, see `cdk.datatables.KeysetPagination`:
+CURSORS = LRUCache(maxsize=10000)
+
+
+class FragmentCache(object):
+    """
+    Cache for rendered HTML fragments of detail pages, keyed by
+    `(resource type, id, data version, locale, host URL, fragment name)` - the host URL,
+    because fragments contain absolute links.
+
+    Fragments are kept in a bounded in-memory LRU cache and - if a directory is configured -
+    in files, which are shared between the processes serving the app and can be filled
+    ahead of time by `prime_cache`.
+    """
+    def __init__(self, maxsize=1000, directory=None):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.directory = directory
+
+    def configure(self, settings):
+        """
+        Configure the cache from the app settings `cdk.fragment_cache_size` and
+        `cdk.fragment_cache_dir`.
+        """
+        self.memory = LRUCache(maxsize=int(settings.get('cdk.fragment_cache_size', 1000)))
+        self.directory = settings.get('cdk.fragment_cache_dir') or None
+        if self.directory and not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def key(req, type_, id_, name):
+        return (type_, id_, req.data_version, req.locale_name, req.host_url, name)
+
+    def _path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha1(repr(key).encode('utf8')).hexdigest() + '.html')
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.directory:
+            try:
+                with io.open(self._path(key), encoding='utf8') as fp:
+                    value = fp.read()
+            except IOError:
+                return None
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.directory:
+            # Write to a temporary file first, so other processes never read partial files:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with io.open(fd, 'w', encoding='utf8') as fp:
+                fp.write(value)
+            os.replace(tmp, self._path(key))
+
+    def clear(self):
+        """
+        Remove all fragments - e.g. those of outdated data versions.
+        """
+        self.memory = LRUCache(maxsize=self.memory.maxsize)
+        if self.directory:
+            for fname in os.listdir(self.directory):
+                if fname.endswith('.html'):
+                    os.remove(os.path.join(self.directory, fname))
+
+    def fragment(self, req, type_, ctx, name, render):
+        """
+        :param render: Callable rendering the fragment if it isn't cached - e.g. a Mako \
+        `capture` of a def.
+        :return: The fragment as `Markup`.
+        """
+        key = self.key(req, type_, ctx.id, name)
+        value = self.get(key)
+        if value is None:
+            value = '{0}'.format(render())
+            self.set(key, value)
+        return Markup(value)
+
+
+FRAGMENTS = FragmentCache()
+
+
+def fragment(req, type_, ctx, name, render):
+    """
+    Cached rendering of fragments of detail pages, e.g. called in a template as
+    `${u.fragment(request, 'unit', ctx, 'content', lambda: capture(content))}`.
+    """
+    return FRAGMENTS.fragment(req, type_, ctx, name, render)
+
+
+def distinct_values(req, col):
+    """
+    Cached version of `clld.db.util.get_distinct_values`, e.g. for choices of datatable
+    columns.
+    """
+    return CACHE.get(
+        req.data_version, ('distinct', str(col)), lambda: get_distinct_values(col))
+
+
+def languages(req):
+    """
+    :return: `list` of `(pk, id, name)` tuples for all languages, i.e. for Ket and its \
+    dialects.
+    """
+    return CACHE.get(req.data_version, 'languages', lambda: [
+        tuple(row) for row in DBSession.query(
+            common.Language.pk, common.Language.id, common.Language.name)
+        .order_by(common.Language.pk)])
@@ -1 +1,83 @@
-#
+# coding: utf8
+import os
+import gzip
+
+from pyramid.view import view_config
+from pyramid.response import Response, FileIter
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from clld.web.datatables.base import type_coerce
+
+from cdk import fts, snapshots, tweens
+
+
+@view_config(route_name='fulltext', renderer='json')
+def fulltext(req):
+    """
+    Full-text search, e.g. `/search?q=кость&type=unitparameter&limit=10`.
+
+    The index is built by `prime_cache`; the same search can be used to restrict the
+    datatables of entries, counterparts and examples via parameter `q`.
+    """
+    qs, type_ = req.params.get('q', ''), req.params.get('type') or None
+    if type_ and type_ not in fts.TYPES:
+        raise HTTPBadRequest('type must be one of {0}'.format(', '.join(fts.TYPES)))
+    limit = max(min(type_coerce(int, req.params.get('limit', 50), 50), 500), 1)
+    return {
+        'query': qs,
+        'results': [
+            dict(res, url=req.route_url(res['type'], id=res['id']))
+            for res in fts.search(qs, type_=type_, limit=limit)],
+    }
+
+
+@view_config(route_name='snapshot')
+def snapshot(req):
+    """
+    The precomputed JSON snapshot of an entry or example sentence, e.g.
+    `/snapshots/unit/1.json` - see `cdk.snapshots`. Served from the file system, without
+    querying the db.
+    """
+    directory = req.registry.settings.get('cdk.snapshot_dir')
+    type_, id_ = req.matchdict['type'], req.matchdict['id']
+    if not directory or type_ not in snapshots.TYPES:
+        raise HTTPNotFound()
+    directory = os.path.join(directory, snapshots.CURRENT)
+
+    # Send the file compressed in the preferred encoding the client accepts - or decompress
+    # the gzipped file otherwise:
+    encodings = [
+        e for e, _ in req.accept_encoding.acceptable_offers(list(snapshots.ENCODINGS))
+    ] if 'Accept-Encoding' in req.headers else []
+    for encoding in encodings + [None]:
+        fname = snapshots.path(directory, type_, id_, encoding=encoding or 'gzip')
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            continue
+        break
+    else:
+        raise HTTPNotFound()
+
+    res = Response(content_type='application/json', charset='utf-8', conditional_response=True)
+    res.etag = '{0:x}-{1:x}-{2}'.format(stat.st_mtime_ns, stat.st_size, encoding or 'identity')
+    res.last_modified = stat.st_mtime
+    res.vary = 'Accept-Encoding'
+    res.cache_control = tweens.cache_control(req.registry.settings)
+    if encoding:
+        res.content_encoding = encoding
+        res.app_iter = FileIter(open(fname, 'rb'))
+        res.content_length = stat.st_size
+    else:
+        with gzip.open(fname, 'rb') as fp:
+            res.body = fp.read()
+    return res
+
+
+def profiling(req):
+    """
+    Queries and timings of the requests served by this process, aggregated per route - if
+    profiling is enabled with setting `cdk.profiling`, see `cdk.tweens.Profiling`.
+    """
+    return {
+        route or '': stats for route, stats in
+        sorted(tweens.STATS.summary().items(), key=lambda i: -i[1]['queries'])}